@@ -0,0 +1,188 @@
+"""Headless batch classification of image archives.
+
+Usage:
+    python batch_classify.py INPUT OUTPUT [--workers 4] [--batch-size 64]
+
+INPUT is a directory (searched recursively) or a manifest file with one image
+path per line. OUTPUT is a .csv or .jsonl file; results are appended as each
+batch finishes, and images already finished in OUTPUT are skipped, so an
+interrupted run resumes where it stopped. Images that errored are retried,
+and the new record is appended after the old one.
+
+Decoding, preprocessing and ROI detection run in a process pool, a few
+images per task; the model sees one batch per ``model.predict`` call,
+normalized in place in a buffer reused for the whole run. Each record's
+status is "ok" (classified), "clear" (healthy skin), "invalid" (failed
+validation) or "error: ...".
+"""
+import argparse
+import csv
+import json
+import multiprocessing as mp
+import os
+import sys
+import time
+
+import numpy as np
+
+import main as pipeline
+
+CSV_FIELDS = ["path", "status", "disease_percent", "predicted_class", "class_name", "confidence"]
+# Statuses that count as done when resuming; "error: ..." rows are retried
+FINISHED_STATUSES = ("ok", "clear", "invalid")
+# Images handed to a worker at once
+CHUNK_SIZE = 8
+
+
+def list_inputs(source):
+    if os.path.isdir(source):
+        return pipeline.list_images(source, recursive=True)
+    with open(source, encoding="utf-8") as manifest:
+        return [line.strip() for line in manifest if line.strip() and not line.startswith("#")]
+
+
+def completed_paths(output):
+    """Paths an earlier run finished; errored images are left to be retried"""
+    if not os.path.exists(output):
+        return set()
+    with open(output, encoding="utf-8", newline="") as f:
+        if output.endswith(".csv"):
+            records = csv.DictReader(f)
+        else:
+            records = []
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue  # truncated last line of an interrupted run
+        return {record["path"] for record in records if record.get("status") in FINISHED_STATUSES}
+
+
+class ResultWriter:
+    def __init__(self, output):
+        self.is_csv = output.endswith(".csv")
+        new_file = not os.path.exists(output) or os.path.getsize(output) == 0
+        self.file = open(output, "a", encoding="utf-8", newline="")
+        if self.is_csv:
+            self.writer = csv.DictWriter(self.file, fieldnames=CSV_FIELDS, extrasaction="ignore")
+            if new_file:
+                self.writer.writeheader()
+
+    def write(self, record):
+        if self.is_csv:
+            self.writer.writerow(record)
+        else:
+            self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def flush(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
+
+
+def prepare_chunk(jobs):
+    """Worker: decode and preprocess a few images; returns [(path, status, disease_percent, model_input), ...]
+
+    The chunk is skin-checked in one pass. Model inputs stay uint8, a
+    quarter of the float32 size to send back to the parent.
+    """
+    results, analyses = [], []
+    for path, mode, denoiser in jobs:
+        try:
+            analyses.append((path, mode, denoiser, pipeline.ImageAnalysis(pipeline.load_image(path, mode=mode))))
+        except Exception as e:
+            results.append((path, f"error: {e}", 0.0, None))
+
+    valid = pipeline.validate_images([analysis for *_, analysis in analyses])
+    for (path, mode, denoiser, analysis), is_valid in zip(analyses, valid):
+        if not is_valid:
+            results.append((path, "invalid", 0.0, None))
+            continue
+        try:
+            _, _, disease_percent, model_input = pipeline.prepare_model_input(
+                analysis, mode=mode, denoiser=denoiser, keep_processed=False, normalize=False
+            )
+            results.append((path, "ok", disease_percent, model_input))
+        except Exception as e:
+            results.append((path, f"error: {e}", 0.0, None))
+    return results
+
+
+def make_record(path, status, disease_percent, predictions=None):
+    return {"path": path, **pipeline.describe_result(disease_percent, predictions, status)}
+
+
+def flush_batch(model, batch, writer, buffer):
+    if not batch:
+        return
+    # The uint8 inputs are already 224x224, so this only copies them into the buffer and normalizes
+    inputs = pipeline.preprocess_for_model_batch([item[3][0] for item in batch], out=buffer)
+    predictions = pipeline.apply_temperature(model.predict(inputs), pipeline.load_temperature())
+    for (path, status, disease_percent, _), pred in zip(batch, predictions):
+        writer.write(make_record(path, status, disease_percent, pred))
+    batch.clear()
+    writer.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("input", help="image directory or manifest file")
+    parser.add_argument("output", help="results file (.csv or .jsonl)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--mode", choices=pipeline.PREPROCESS_MODES, default="fast")
+    parser.add_argument("--denoiser", choices=pipeline.DENOISERS, default="bilateral")
+    args = parser.parse_args()
+
+    if not args.output.endswith((".csv", ".jsonl")):
+        parser.error("output must end in .csv or .jsonl")
+
+    paths = list_inputs(args.input)
+    done = completed_paths(args.output)
+    todo = [p for p in paths if p not in done]
+    print(f"{len(paths)} images, {len(done)} already done, {len(todo)} to process", file=sys.stderr)
+    if not todo:
+        return
+
+    model = pipeline.load_model()
+    if model is None:
+        raise SystemExit("Model could not be loaded")
+
+    writer = ResultWriter(args.output)
+    size = pipeline.MODEL_INPUT_SIZE
+    buffer = np.empty((args.batch_size, size, size, 3), dtype=np.float32)
+    batch = []
+    processed = 0
+    start = time.perf_counter()
+    # Spawned workers avoid inheriting TensorFlow's threads from the parent
+    ctx = mp.get_context("spawn")
+    try:
+        with ctx.Pool(args.workers) as pool:
+            chunks = ([(path, args.mode, args.denoiser) for path in todo[i:i + CHUNK_SIZE]]
+                      for i in range(0, len(todo), CHUNK_SIZE))
+            for results in pool.imap_unordered(prepare_chunk, chunks):
+                for item in results:
+                    path, status, disease_percent, model_input = item
+                    if model_input is not None:
+                        batch.append(item)
+                        if len(batch) >= args.batch_size:
+                            flush_batch(model, batch, writer, buffer)
+                    else:
+                        writer.write(make_record(path, status, disease_percent))
+                    processed += 1
+                    if processed % 500 == 0:
+                        rate = processed / (time.perf_counter() - start)
+                        print(f"{processed}/{len(todo)} images, {rate:.1f} images/sec", file=sys.stderr)
+            flush_batch(model, batch, writer, buffer)
+    finally:
+        writer.close()
+
+    elapsed = time.perf_counter() - start
+    print(f"Processed {processed} images in {elapsed:.1f}s ({processed / elapsed:.1f} images/sec)",
+          file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
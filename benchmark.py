@@ -0,0 +1,246 @@
+"""Benchmark suite for the preprocessing and inference hot paths.
+
+Usage:
+    python benchmark.py [--resolutions vga 2mp 12mp] [--repeat 5] [--output bench.json]
+                        [--baseline baseline.json] [--max-regression 10]
+
+Runs offline on CPU against synthetic skin-toned images with dark lesions
+(seeded, so every run sees the same pixels). For each resolution it times
+validate, preprocess, roi and model_input (one image and batched), the
+end-to-end path with one predict per image, and the end-to-end path with
+one batched predict. The
+model is timed alone at several batch sizes. Each scenario reports
+p50/p95/mean latency, throughput and peak RSS.
+
+Results are written as JSON. With --baseline, p50 latencies are compared
+against an earlier results file, and the exit status is 1 if any scenario
+slowed down by more than --max-regression percent.
+
+skin_disease.h5 is used when present; otherwise a small stand-in Keras
+model with the same input and output shapes is built, so the suite still
+runs (model timings are then only comparable with other stand-in runs). The
+stand-in runs under the requested keras or function backend; tflite always
+needs an exported file.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import sys
+import time
+
+import cv2
+import numpy as np
+
+import main as pipeline
+from inference import MODEL_PATH, BACKENDS, FunctionBackend, KerasBackend, load_backend
+
+RESOLUTIONS = {
+    "vga": (480, 640),
+    "2mp": (1200, 1600),
+    "5mp": (1944, 2592),
+    "12mp": (3000, 4000),
+}
+PREPROCESS_SETTINGS = {
+    "fast": ("fast", "bilateral"),
+    "full": ("full", "nlmeans"),
+}
+BATCH_SIZES = (1, 8, 32)
+E2E_BATCH = 8
+
+
+def synthetic_skin_image(height, width, seed=0):
+    """Skin-toned gradient with a few dark lesions and sensor noise"""
+    rng = np.random.default_rng(seed)
+    ramp = np.linspace(0.9, 1.1, width, dtype=np.float32)[None, :, None]
+    base = np.array([205, 150, 120], dtype=np.float32)[None, None, :]
+    img = np.clip(base * ramp, 0, 255).astype(np.uint8)
+    img = np.repeat(img, height, axis=0)
+    for _ in range(3):
+        center = (int(rng.integers(width // 5, 4 * width // 5)), int(rng.integers(height // 5, 4 * height // 5)))
+        axes = (int(rng.integers(width // 30, width // 10)), int(rng.integers(height // 30, height // 10)))
+        color = tuple(int(c) for c in rng.integers((70, 35, 30), (120, 70, 60)))
+        cv2.ellipse(img, center, axes, float(rng.integers(0, 180)), 0, 360, color, -1)
+    noise = rng.integers(-8, 9, img.shape, dtype=np.int16)
+    return np.clip(img.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+
+
+def standin_backend(backend="keras"):
+    """Small random model wrapped in the requested Keras-based backend"""
+    import tensorflow as tf
+    tf.keras.utils.set_random_seed(0)
+    size = pipeline.MODEL_INPUT_SIZE
+    model = tf.keras.Sequential([
+        tf.keras.Input((size, size, 3)),
+        tf.keras.layers.Conv2D(16, 3, strides=2, activation="relu"),
+        tf.keras.layers.Conv2D(32, 3, strides=2, activation="relu"),
+        tf.keras.layers.Conv2D(64, 3, strides=2, activation="relu"),
+        tf.keras.layers.GlobalAveragePooling2D(),
+        tf.keras.layers.Dense(len(pipeline.CLASS_NAMES), activation="softmax"),
+    ])
+    return FunctionBackend(model) if backend == "function" else KerasBackend(model)
+
+
+def reset_peak_rss():
+    """Reset the kernel's peak-RSS counter where supported (Linux)"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def peak_rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == "darwin" else peak / 1024
+
+
+def measure(fn, repeat, warmup=1, items=1):
+    for _ in range(warmup):
+        fn()
+    reset_peak_rss()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    ms = np.array(times) * 1000
+    return {
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(ms, 95)), 3),
+        "mean_ms": round(float(ms.mean()), 3),
+        "throughput_per_s": round(items / (ms.mean() / 1000), 3),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "repeat": repeat,
+    }
+
+
+def validated(image):
+    """Fresh ImageAnalysis that skips re-validation, to time one stage in isolation"""
+    analysis = pipeline.ImageAnalysis(image)
+    analysis.is_valid = True
+    return analysis
+
+
+def stage_scenarios(image, mode, denoiser, backend):
+    processed = pipeline.apply_advanced_preprocessing(validated(image), mode=mode, denoiser=denoiser)
+    roi_img, _ = pipeline.remove_background_and_focus_roi(processed, analysis=validated(image))
+    if roi_img is None:
+        raise SystemExit("Synthetic image produced no ROI; check the generator")
+
+    def end_to_end():
+        *_, model_input = pipeline.prepare_model_input(image, mode=mode, denoiser=denoiser)
+        if model_input is not None:
+            backend.predict(model_input)
+
+    size = pipeline.MODEL_INPUT_SIZE
+    buffer = np.empty((E2E_BATCH, size, size, 3), dtype=np.float32)
+    batch = [image] * E2E_BATCH
+    roi_batch = [roi_img] * E2E_BATCH
+
+    def end_to_end_batched():
+        inputs = [pipeline.prepare_model_input(image, mode=mode, denoiser=denoiser)[3] for _ in range(E2E_BATCH)]
+        backend.predict(np.concatenate([x for x in inputs if x is not None]))
+
+    return {
+        "validate": (lambda: pipeline.validate_image(pipeline.ImageAnalysis(image)), 1),
+        "preprocess": (lambda: pipeline.apply_advanced_preprocessing(validated(image), mode=mode,
+                                                                     denoiser=denoiser), 1),
+        "roi": (lambda: pipeline.remove_background_and_focus_roi(processed, analysis=validated(image)), 1),
+        f"validate_batch{E2E_BATCH}": (lambda: pipeline.validate_images(batch), E2E_BATCH),
+        "model_input": (lambda: pipeline.preprocess_for_model(roi_img, analysis=validated(image)), 1),
+        f"model_input_batch{E2E_BATCH}": (lambda: pipeline.preprocess_for_model_batch(roi_batch, out=buffer),
+                                          E2E_BATCH),
+        "end_to_end": (end_to_end, 1),
+        f"end_to_end_batch{E2E_BATCH}": (end_to_end_batched, E2E_BATCH),
+    }
+
+
+def compare(results, baseline, max_regression):
+    """Print p50 deltas against a baseline; returns the names of regressed scenarios"""
+    regressed = []
+    print(f"\n{'scenario':>44} {'base p50':>10} {'new p50':>10} {'delta':>8}")
+    for name, current in results["scenarios"].items():
+        previous = baseline["scenarios"].get(name)
+        if previous is None:
+            continue
+        delta = (current["p50_ms"] - previous["p50_ms"]) / previous["p50_ms"] * 100
+        flag = ""
+        if delta > max_regression:
+            regressed.append(name)
+            flag = "  REGRESSED"
+        print(f"{name:>44} {previous['p50_ms']:10.2f} {current['p50_ms']:10.2f} {delta:+7.1f}%{flag}")
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--resolutions", nargs="+", choices=RESOLUTIONS, default=list(RESOLUTIONS))
+    parser.add_argument("--preprocess", nargs="+", choices=PREPROCESS_SETTINGS, default=["fast"],
+                        help="'full' runs NL-means at native resolution and is slow on large images")
+    parser.add_argument("--backend", choices=BACKENDS, default="keras")
+    parser.add_argument("--model", default=MODEL_PATH)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", help="earlier results file to compare against")
+    parser.add_argument("--max-regression", type=float, default=10.0,
+                        help="allowed p50 slowdown in percent before failing")
+    args = parser.parse_args()
+
+    if os.path.exists(args.model) or args.backend == "tflite":
+        backend, model_name = load_backend(args.backend, args.model), args.model
+    else:
+        backend, model_name = standin_backend(args.backend), "stand-in"
+    print(f"model: {model_name} ({backend.name})", file=sys.stderr)
+
+    scenarios = {}
+    inputs = np.random.default_rng(0).random((max(BATCH_SIZES),) + backend.input_shape, dtype=np.float32)
+    for batch_size in BATCH_SIZES:
+        name = f"predict/batch{batch_size}"
+        scenarios[name] = measure(lambda: backend.predict(inputs[:batch_size]), args.repeat, items=batch_size)
+        print(f"{name:>44}: p50 {scenarios[name]['p50_ms']:9.2f} ms", file=sys.stderr)
+
+    for resolution in args.resolutions:
+        image = synthetic_skin_image(*RESOLUTIONS[resolution])
+        for setting in args.preprocess:
+            mode, denoiser = PREPROCESS_SETTINGS[setting]
+            for stage_name, (fn, items) in stage_scenarios(image, mode, denoiser, backend).items():
+                name = f"{resolution}/{setting}/{stage_name}"
+                scenarios[name] = measure(fn, args.repeat, items=items)
+                print(f"{name:>44}: p50 {scenarios[name]['p50_ms']:9.2f} ms", file=sys.stderr)
+
+    results = {
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "numpy": np.__version__,
+            "opencv": cv2.__version__,
+            "model": model_name,
+            "backend": backend.name,
+        },
+        "scenarios": scenarios,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    print(f"Results written to {args.output}", file=sys.stderr)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline["environment"].get("model") != model_name:
+            print("warning: baseline was recorded with a different model", file=sys.stderr)
+        if compare(results, baseline, args.max_regression):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""Benchmark the shared ImageAnalysis against per-stage validation.
+
+Usage:
+    python benchmark_analysis.py [--repeat 5]
+
+Before ImageAnalysis, one upload was validated four times (main,
+apply_advanced_preprocessing, remove_background_and_focus_roi and
+preprocess_for_model), each with its own array copy, HSV conversion and skin
+mask. This script replays that against a single ImageAnalysis on synthetic
+decoded uploads (arrays, as load_image returns them) and reports wall time,
+peak traced memory and the memory each path still holds once it is done.
+"""
+import argparse
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from main import LOWER_SKIN, UPPER_SKIN, ImageAnalysis, validate_image
+
+SIZES = {
+    "2MP": (1200, 1600),
+    "12MP": (3000, 4000),
+    "20MP": (3888, 5184),
+}
+
+
+def synthetic_upload(height, width, seed=0):
+    rng = np.random.default_rng(seed)
+    img = np.empty((height, width, 3), dtype=np.uint8)
+    img[:] = (200, 140, 110)
+    img[height // 3:height // 2, width // 3:width // 2] = (90, 50, 40)
+    img += rng.integers(0, 20, img.shape, dtype=np.uint8)
+    return img
+
+
+def legacy_validate(image):
+    """The skin check as every stage ran it before ImageAnalysis."""
+    img_array = np.array(image) if isinstance(image, Image.Image) else image
+    hsv = cv2.cvtColor(img_array, cv2.COLOR_RGB2HSV)
+    skin_mask = cv2.inRange(hsv, LOWER_SKIN, UPPER_SKIN)
+    return cv2.countNonZero(skin_mask) / (img_array.shape[0] * img_array.shape[1]) * 100 >= 5
+
+
+def legacy_path(image):
+    legacy_validate(image)  # main
+    legacy_validate(image)  # apply_advanced_preprocessing
+    img = np.array(image)
+    legacy_validate(img)  # remove_background_and_focus_roi
+    legacy_validate(img)  # preprocess_for_model
+
+
+def analysis_path(image):
+    analysis = ImageAnalysis(image)
+    validate_image(analysis)
+    for _ in range(3):  # later stages hit the cached result
+        validate_image(analysis)
+    return analysis
+
+
+def measure(fn, image, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(image)
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    result = fn(image)
+    kept, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return min(times), peak, kept
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'size':>6} {'legacy ms':>10} {'shared ms':>10} {'legacy MB':>10} {'shared MB':>10} {'kept MB':>8}")
+    for name, (height, width) in SIZES.items():
+        image = synthetic_upload(height, width)
+        legacy_t, legacy_mem, _ = measure(legacy_path, image, args.repeat)
+        shared_t, shared_mem, shared_kept = measure(analysis_path, image, args.repeat)
+        print(f"{name:>6} {legacy_t * 1000:10.1f} {shared_t * 1000:10.1f} "
+              f"{legacy_mem / 2**20:10.1f} {shared_mem / 2**20:10.1f} {shared_kept / 2**20:8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""Fit temperature-scaling calibration for the classifier.
+
+Usage:
+    python calibrate.py LABELED_DIR [--output calibration.json]
+
+LABELED_DIR holds one sub-directory per class, named by class index (0-6)
+or abbreviation (akiec, bcc, bkl, df, mel, nv, vasc). Every image runs
+through the app's preprocessing and the uncalibrated model, and the single
+temperature minimizing negative log-likelihood is written to the output
+file, which the app, batch CLI, inference server and camera stream read
+from CALIBRATION_FILE (default calibration.json).
+"""
+import argparse
+import json
+import os
+import re
+
+import numpy as np
+
+import main as pipeline
+
+TEMPERATURES = np.geomspace(0.05, 20, 600)
+
+
+def class_index(folder):
+    if folder.isdigit() and int(folder) in pipeline.CLASS_NAMES:
+        return int(folder)
+    for index, name in pipeline.CLASS_NAMES.items():
+        if re.search(r"\((\w+)\)", name).group(1) == folder.lower():
+            return index
+    return None
+
+
+def collect(labeled_dir, mode, denoiser, model):
+    predictions, labels = [], []
+    for folder in sorted(os.listdir(labeled_dir)):
+        label = class_index(folder)
+        path = os.path.join(labeled_dir, folder)
+        if label is None or not os.path.isdir(path):
+            continue
+        for image_path in pipeline.list_images(path):
+            analysis = pipeline.ImageAnalysis(pipeline.load_image(image_path, mode=mode))
+            if not pipeline.validate_image(analysis):
+                continue
+            *_, model_input = pipeline.prepare_model_input(
+                analysis, mode=mode, denoiser=denoiser, keep_processed=False
+            )
+            if model_input is not None:
+                predictions.append(model.predict(model_input)[0])
+                labels.append(label)
+    return np.array(predictions), np.array(labels)
+
+
+def nll(probabilities, labels):
+    return float(-np.mean(np.log(np.clip(probabilities[np.arange(len(labels)), labels], 1e-12, 1.0))))
+
+
+def expected_calibration_error(probabilities, labels, bins=15):
+    confidence = probabilities.max(axis=1)
+    correct = probabilities.argmax(axis=1) == labels
+    edges = np.linspace(0, 1, bins + 1)
+    error = 0.0
+    for low, high in zip(edges[:-1], edges[1:]):
+        in_bin = (confidence > low) & (confidence <= high)
+        if in_bin.any():
+            error += in_bin.mean() * abs(correct[in_bin].mean() - confidence[in_bin].mean())
+    return float(error)
+
+
+def fit_temperature(probabilities, labels):
+    losses = [nll(pipeline.apply_temperature(probabilities, t), labels) for t in TEMPERATURES]
+    return float(TEMPERATURES[int(np.argmin(losses))])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("labeled_dir")
+    parser.add_argument("--output", default=pipeline.CALIBRATION_FILE)
+    parser.add_argument("--mode", choices=pipeline.PREPROCESS_MODES, default="fast")
+    parser.add_argument("--denoiser", choices=pipeline.DENOISERS, default="bilateral")
+    args = parser.parse_args()
+
+    model = pipeline.load_model()
+    if model is None:
+        raise SystemExit("Model could not be loaded")
+
+    probabilities, labels = collect(args.labeled_dir, args.mode, args.denoiser, model)
+    if len(labels) == 0:
+        raise SystemExit(f"No labeled, classifiable images in {args.labeled_dir}")
+
+    temperature = fit_temperature(probabilities, labels)
+    calibrated = pipeline.apply_temperature(probabilities, temperature)
+    report = {
+        "temperature": temperature,
+        "samples": int(len(labels)),
+        "nll_before": nll(probabilities, labels),
+        "nll_after": nll(calibrated, labels),
+        "ece_before": expected_calibration_error(probabilities, labels),
+        "ece_after": expected_calibration_error(calibrated, labels),
+    }
+    # Write then rename, so running processes never read a half-written file
+    with open(args.output + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    os.replace(args.output + ".tmp", args.output)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
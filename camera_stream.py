@@ -0,0 +1,297 @@
+"""Live camera / video stream analysis.
+
+Usage:
+    python camera_stream.py [SOURCE] [--output annotated.mp4] [--infer-every 30]
+
+SOURCE is a webcam index (default 0) or a video file. Frames are grabbed on
+a background thread that keeps only the newest one, so a slow consumer
+drops stale frames instead of falling behind; video files read with
+--no-realtime are the exception and every frame is processed. Each frame
+gets the skin check and ROI detection on a downscaled copy; the lesion is
+tracked by searching near its last position before falling back to the
+whole frame. The model classifies a crop of the tracked box off-thread, and
+only when the ROI moves or grows materially or every --infer-every frames.
+Class probabilities are smoothed across inferences and the shown label only
+switches once another class clearly leads, so results don't flicker.
+
+The same StreamAnalyzer powers the "Live camera" input in the Streamlit app
+when the operator sets LIVE_CAMERA_SOURCE.
+"""
+import argparse
+import json
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+import main as pipeline
+
+# Long side of the frame used for the skin check and ROI tracking
+ANALYSIS_SIZE = 320
+# Run the model at least this often, in processed frames
+INFER_EVERY = 30
+# Re-run the model when the tracked box overlaps the last classified box less than this
+CHANGE_IOU = 0.6
+# Weight of the newest inference in the smoothed probabilities
+SMOOTHING = 0.5
+# How far a new class must lead the shown one before the label switches
+SWITCH_MARGIN = 0.1
+# Search window around the previous lesion box, as a fraction of its size
+SEARCH_MARGIN = 0.5
+
+
+class FrameGrabber:
+    """Reads frames on a background thread, keeping only the newest
+
+    Video files read without realtime pacing drop nothing: the reader waits
+    for each frame to be taken before reading the next.
+    """
+
+    def __init__(self, source, realtime=None):
+        self.capture = cv2.VideoCapture(int(source) if str(source).isdigit() else source)
+        if not self.capture.isOpened():
+            raise RuntimeError(f"Cannot open video source {source}")
+        # Video files are paced to their own frame rate; cameras deliver in real time
+        is_file = not str(source).isdigit()
+        fps = self.capture.get(cv2.CAP_PROP_FPS) or 30
+        self.frame_interval = 1 / fps if (realtime if realtime is not None else is_file) else 0
+        self.drop_frames = not is_file or bool(self.frame_interval)
+        self.frames_read = 0
+        self.frames_dropped = 0
+        self.finished = False
+        self._frame = None
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="frame-grabber", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self.finished:
+            start = time.perf_counter()
+            if not self.drop_frames:
+                with self._condition:
+                    self._condition.wait_for(lambda: self._frame is None or self.finished)
+                if self.finished:
+                    break
+            ok, frame = self.capture.read()
+            with self._condition:
+                if not ok:
+                    self.finished = True
+                else:
+                    if self._frame is not None:
+                        self.frames_dropped += 1
+                    self._frame = frame
+                    self.frames_read += 1
+                self._condition.notify()
+            if self.frame_interval:
+                time.sleep(max(0.0, self.frame_interval - (time.perf_counter() - start)))
+
+    def latest(self, timeout=1.0):
+        """Newest unread frame as RGB, or None when the stream has ended"""
+        with self._condition:
+            self._condition.wait_for(lambda: self._frame is not None or self.finished, timeout)
+            frame, self._frame = self._frame, None
+            self._condition.notify()
+        return None if frame is None else cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+
+    def close(self):
+        with self._condition:
+            self.finished = True
+            self._condition.notify()
+        self._thread.join(timeout=2)
+        self.capture.release()
+
+
+def box_iou(a, b):
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    iw = max(0, min(ax + aw, bx + bw) - max(ax, bx))
+    ih = max(0, min(ay + ah, by + bh) - max(ay, by))
+    inter = iw * ih
+    union = aw * ah + bw * bh - inter
+    return inter / union if union else 0.0
+
+
+class StreamAnalyzer:
+    """Per-frame skin check and lesion tracking with throttled, smoothed classification"""
+
+    def __init__(self, model, analysis_size=ANALYSIS_SIZE, infer_every=INFER_EVERY,
+                 mode="fast", denoiser="bilateral"):
+        self.model = model
+        self.analysis_size = analysis_size
+        self.infer_every = infer_every
+        self.mode = mode
+        self.denoiser = denoiser
+        self.frames = 0
+        self.inferences = 0
+        self.bbox = None
+        self.probabilities = None
+        self.shown_class = None
+        self._last_inferred_bbox = None
+        self._frames_since_inference = 0
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="stream-infer")
+        self._pending = None
+
+    def _classify(self, frame, bbox):
+        """Classify the tracked lesion box of ``frame``, padded like the per-lesion crops"""
+        x, y, w, h = bbox
+        height, width = frame.shape[:2]
+        margin_x, margin_y = int(w * pipeline.LESION_CROP_MARGIN), int(h * pipeline.LESION_CROP_MARGIN)
+        crop = frame[max(0, y - margin_y):min(height, y + h + margin_y),
+                     max(0, x - margin_x):min(width, x + w + margin_x)]
+        # The tracker already skin-checked the frame and accepted this box
+        analysis = pipeline.ImageAnalysis(crop)
+        analysis.is_valid = True
+        processed = pipeline.apply_advanced_preprocessing(analysis, mode=self.mode, denoiser=self.denoiser)
+        model_input = pipeline.preprocess_for_model(processed, analysis=analysis)
+        if model_input is None:
+            return None
+        return pipeline.apply_temperature(self.model.predict(model_input), pipeline.load_temperature())[0]
+
+    def _collect_inference(self):
+        if self._pending is None or not self._pending.done():
+            return
+        predictions, self._pending = self._pending.result(), None
+        if predictions is None:
+            return
+        self.inferences += 1
+        if self.probabilities is None:
+            self.probabilities = predictions
+        else:
+            self.probabilities = SMOOTHING * predictions + (1 - SMOOTHING) * self.probabilities
+
+        leader = int(np.argmax(self.probabilities))
+        if self.shown_class is None or (
+                leader != self.shown_class
+                and self.probabilities[leader] - self.probabilities[self.shown_class] > SWITCH_MARGIN):
+            self.shown_class = leader
+
+    def _track(self, gray, frame_area):
+        """Find the lesion near its last position, falling back to the whole frame"""
+        if self.bbox is not None:
+            height, width = gray.shape
+            x, y, w, h = self.bbox
+            mx, my = int(w * SEARCH_MARGIN), int(h * SEARCH_MARGIN)
+            x0, y0 = max(0, x - mx), max(0, y - my)
+            x1, y1 = min(width, x + w + mx), min(height, y + h + my)
+            lesions = pipeline.detect_lesion_contours(gray[y0:y1, x0:x1], image_area=frame_area)
+            if lesions:
+                contour, area = lesions[0]
+                return contour + np.array([x0, y0], dtype=contour.dtype), area
+        lesions = pipeline.detect_lesion_contours(gray)
+        return lesions[0] if lesions else (None, 0.0)
+
+    def process(self, frame):
+        """Analyze one RGB frame; returns a dict describing the current state"""
+        self.frames += 1
+        self._frames_since_inference += 1
+        self._collect_inference()
+
+        height, width = frame.shape[:2]
+        scale = min(1.0, self.analysis_size / max(height, width))
+        small = cv2.resize(frame, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+        analysis = pipeline.ImageAnalysis(small)
+
+        state = {"frame": self.frames, "status": "no_skin", "bbox": None, "disease_percent": 0.0,
+                 "predicted_class": None, "confidence": None, "inferred": False}
+        if analysis.skin_percentage < 5:
+            self.bbox = None
+            return state
+
+        frame_area = small.shape[0] * small.shape[1]
+        contour, area = self._track(analysis.gray, frame_area)
+        if contour is None:
+            self.bbox = None
+            state["status"] = "clear"
+            return state
+
+        self.bbox = cv2.boundingRect(contour)
+        state["disease_percent"] = area / frame_area * 100
+        state["bbox"] = tuple(int(v / scale) for v in self.bbox)
+
+        changed = (self._last_inferred_bbox is None
+                   or box_iou(self.bbox, self._last_inferred_bbox) < CHANGE_IOU)
+        if (changed or self._frames_since_inference >= self.infer_every) and self._pending is None:
+            self._pending = self._executor.submit(self._classify, frame, state["bbox"])
+            self._last_inferred_bbox = self.bbox
+            self._frames_since_inference = 0
+            state["inferred"] = True
+
+        state["status"] = "clear"
+        if self.shown_class is not None and state["disease_percent"] > 1:
+            confidence = min(float(self.probabilities[self.shown_class]) * 100, 100.0)
+            if confidence >= pipeline.CONFIDENCE_THRESHOLD:
+                state.update(status="ok", predicted_class=self.shown_class, confidence=round(confidence, 2))
+        return state
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def annotate(frame, state):
+    """Copy of ``frame`` with the tracked box and current label drawn on it"""
+    annotated = frame.copy()
+    if state["bbox"] is not None:
+        x, y, w, h = state["bbox"]
+        cv2.rectangle(annotated, (x, y), (x + w, y + h), (0, 255, 0), 2)
+    if state["predicted_class"] is not None:
+        label = f"{pipeline.CLASS_NAMES_MM[state['predicted_class']]} {state['confidence']:.0f}%"
+    else:
+        label = state["status"]
+    cv2.putText(annotated, label, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 255, 0), 2)
+    return annotated
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("source", nargs="?", default="0", help="webcam index or video file")
+    parser.add_argument("--output", help="write the annotated stream to this video file")
+    parser.add_argument("--analysis-size", type=int, default=ANALYSIS_SIZE)
+    parser.add_argument("--infer-every", type=int, default=INFER_EVERY)
+    parser.add_argument("--max-frames", type=int)
+    parser.add_argument("--no-realtime", action="store_true",
+                        help="read video files as fast as possible instead of at their frame rate")
+    parser.add_argument("--log", action="store_true", help="print one JSON line per frame")
+    args = parser.parse_args()
+
+    model = pipeline.load_model()
+    if model is None:
+        raise SystemExit("Model could not be loaded")
+
+    grabber = FrameGrabber(args.source, realtime=False if args.no_realtime else None)
+    analyzer = StreamAnalyzer(model, analysis_size=args.analysis_size, infer_every=args.infer_every)
+    writer = None
+    start = time.perf_counter()
+    try:
+        while args.max_frames is None or analyzer.frames < args.max_frames:
+            frame = grabber.latest()
+            if frame is None:
+                if grabber.finished:
+                    break
+                continue
+            state = analyzer.process(frame)
+            if args.log:
+                print(json.dumps(state))
+            if args.output:
+                if writer is None:
+                    height, width = frame.shape[:2]
+                    fps = grabber.capture.get(cv2.CAP_PROP_FPS) or 30
+                    writer = cv2.VideoWriter(args.output, cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
+                writer.write(cv2.cvtColor(annotate(frame, state), cv2.COLOR_RGB2BGR))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        grabber.close()
+        analyzer.close()
+        if writer is not None:
+            writer.release()
+
+    elapsed = time.perf_counter() - start
+    print(f"{analyzer.frames} frames in {elapsed:.1f}s ({analyzer.frames / elapsed:.1f} fps), "
+          f"{grabber.frames_dropped} dropped, {analyzer.inferences} inferences", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Compare inference backends against the Keras .h5 baseline.
+
+Usage:
+    python compare_backends.py IMAGE_DIR [--backends keras function tflite:skin_disease_float16.tflite]
+
+Each image is preprocessed once; every backend then classifies the same model
+inputs. Reports single-image latency (p50/p95), batched throughput, agreement
+of the predicted class and of the label shown to the user with the baseline,
+and the largest confidence difference.
+"""
+import argparse
+import time
+
+import numpy as np
+from PIL import Image
+
+from inference import MODEL_PATH, load_backend
+from main import list_images, prepare_model_input, shown_label
+
+
+def load_inputs(image_dir):
+    inputs = []
+    for path in list_images(image_dir):
+        with Image.open(path) as image:
+            *_, model_input = prepare_model_input(image.convert("RGB"), mode="fast", denoiser="bilateral")
+        if model_input is not None:
+            inputs.append(model_input)
+    return np.concatenate(inputs) if inputs else None
+
+
+def build(spec, model_path, num_threads):
+    """``spec`` is a backend name, optionally ``tflite:PATH``"""
+    name, _, path = spec.partition(":")
+    return load_backend(name, model_path, tflite_path=path or None, num_threads=num_threads)
+
+
+def run(backend, inputs, batch_size):
+    backend.predict(inputs[:1])  # warm-up
+    latencies = []
+    outputs = []
+    for i in range(len(inputs)):
+        start = time.perf_counter()
+        outputs.append(backend.predict(inputs[i:i + 1])[0])
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for i in range(0, len(inputs), batch_size):
+        backend.predict(inputs[i:i + batch_size])
+    throughput = len(inputs) / (time.perf_counter() - start)
+    return np.array(outputs), np.array(latencies) * 1000, throughput
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("image_dir")
+    parser.add_argument("--model", default=MODEL_PATH)
+    parser.add_argument("--backends", nargs="+", default=["keras", "function", "tflite"])
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--threads", type=int, help="TFLite interpreter threads")
+    args = parser.parse_args()
+
+    inputs = load_inputs(args.image_dir)
+    if inputs is None:
+        raise SystemExit(f"No classifiable images in {args.image_dir}")
+
+    baseline, _, _ = run(build("keras", args.model, args.threads), inputs, args.batch_size)
+    baseline_classes = baseline.argmax(axis=1)
+    baseline_labels = [shown_label(p) for p in baseline]
+
+    print(f"{len(inputs)} images, baseline: keras ({args.model})")
+    print(f"{'backend':>40} {'p50 ms':>8} {'p95 ms':>8} {'img/s':>8} {'class':>7} {'label':>7} {'max dconf':>9}")
+    for spec in args.backends:
+        outputs, latencies, throughput = run(build(spec, args.model, args.threads), inputs, args.batch_size)
+        class_agree = np.mean(outputs.argmax(axis=1) == baseline_classes) * 100
+        label_agree = np.mean([shown_label(p) == b for p, b in zip(outputs, baseline_labels)]) * 100
+        max_conf_diff = np.max(np.abs(outputs.max(axis=1) - baseline.max(axis=1))) * 100
+        print(f"{spec:>40} {np.percentile(latencies, 50):8.2f} {np.percentile(latencies, 95):8.2f} "
+              f"{throughput:8.1f} {class_agree:6.1f}% {label_agree:6.1f}% {max_conf_diff:8.2f}%")
+
+
+if __name__ == "__main__":
+    main()
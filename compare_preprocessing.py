@@ -0,0 +1,65 @@
+"""Compare the full-resolution and fast preprocessing paths.
+
+Usage:
+    python compare_preprocessing.py IMAGE_DIR [--denoiser bilateral] [--repeat 3]
+
+Reports per-path latency (p50/p95), decoding included, and how often the
+fast path agrees with the full path on the predicted class. Each path decodes
+the file with load_image in its own mode, as the app does.
+"""
+import argparse
+import time
+
+import numpy as np
+
+from main import DENOISERS, list_images, load_image, run_pipeline, shown_label
+
+
+def timed_run(path, mode, denoiser, repeat):
+    timings = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = run_pipeline(load_image(path, mode=mode), mode=mode, denoiser=denoiser)
+        timings.append(time.perf_counter() - start)
+    return result, timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("image_dir")
+    parser.add_argument("--denoiser", choices=DENOISERS, default="bilateral",
+                        help="denoiser used by the fast path")
+    parser.add_argument("--repeat", type=int, default=1)
+    args = parser.parse_args()
+
+    paths = list_images(args.image_dir)
+    if not paths:
+        raise SystemExit(f"No images found in {args.image_dir}")
+
+    full_times, fast_times = [], []
+    class_agree = label_agree = 0
+    for path in paths:
+        full, t_full = timed_run(path, "full", "nlmeans", args.repeat)
+        fast, t_fast = timed_run(path, "fast", args.denoiser, args.repeat)
+        full_pct, full_pred = full.disease_percent, full.predictions
+        fast_pct, fast_pred = fast.disease_percent, fast.predictions
+        full_times.extend(t_full)
+        fast_times.extend(t_fast)
+
+        if full_pred is not None and fast_pred is not None:
+            class_agree += int(np.argmax(full_pred) == np.argmax(fast_pred))
+        elif full_pred is None and fast_pred is None:
+            class_agree += 1
+        label_agree += int(shown_label(full_pred, full_pct) == shown_label(fast_pred, fast_pct))
+
+    print(f"images: {len(paths)}  repeat: {args.repeat}")
+    for name, times in (("full/nlmeans", full_times), (f"fast/{args.denoiser}", fast_times)):
+        ms = np.array(times) * 1000
+        print(f"{name:>16}: p50 {np.percentile(ms, 50):8.1f} ms  p95 {np.percentile(ms, 95):8.1f} ms")
+    print(f"argmax agreement:    {100 * class_agree / len(paths):.1f}%")
+    print(f"displayed agreement: {100 * label_agree / len(paths):.1f}%")
+
+
+if __name__ == "__main__":
+    main()
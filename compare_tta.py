@@ -0,0 +1,89 @@
+"""Measure the cost and stability gain of test-time augmentation.
+
+Usage:
+    python compare_tta.py IMAGE_DIR [--perturbations 10] [--repeat 5]
+
+For every classifiable image, the model input is perturbed slightly
+(brightness, a few pixels of shift, noise) several times. The report shows
+how often the label shown to the user flips under those perturbations with
+a single forward pass and with TTA, along with the latency of one pass
+against one batched TTA pass.
+"""
+import argparse
+import time
+
+import numpy as np
+
+import main as pipeline
+
+
+def perturb(model_input, rng):
+    img = model_input * rng.uniform(0.9, 1.1)
+    img = np.roll(img, tuple(rng.integers(-4, 5, size=2)), axis=(1, 2))
+    img = img + rng.normal(0, 0.02, img.shape)
+    return np.clip(img, 0, 1).astype(np.float32)
+
+
+def classify(model, model_input, tta, temperature):
+    if not tta:
+        return pipeline.apply_temperature(model.predict(model_input), temperature)[0]
+    outputs = pipeline.apply_temperature(model.predict(pipeline.tta_views(model_input)), temperature)
+    return pipeline.aggregate_tta(outputs)[0]
+
+
+def median_ms(fn, repeat):
+    fn()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return float(np.median(times) * 1000)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("image_dir")
+    parser.add_argument("--perturbations", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    model = pipeline.load_model()
+    if model is None:
+        raise SystemExit("Model could not be loaded")
+    temperature = pipeline.load_temperature()
+    rng = np.random.default_rng(args.seed)
+
+    inputs = []
+    for path in pipeline.list_images(args.image_dir):
+        *_, model_input = pipeline.prepare_model_input(
+            pipeline.load_image(path, mode="fast"), mode="fast", denoiser="bilateral", keep_processed=False
+        )
+        if model_input is not None:
+            inputs.append(model_input)
+    if not inputs:
+        raise SystemExit(f"No classifiable images in {args.image_dir}")
+
+    flips = {False: 0, True: 0}
+    trials = 0
+    for model_input in inputs:
+        base = {tta: pipeline.shown_label(classify(model, model_input, tta, temperature)) for tta in (False, True)}
+        for _ in range(args.perturbations):
+            perturbed = perturb(model_input, rng)
+            trials += 1
+            for tta in (False, True):
+                flips[tta] += pipeline.shown_label(classify(model, perturbed, tta, temperature)) != base[tta]
+
+    single_ms = median_ms(lambda: model.predict(inputs[0]), args.repeat)
+    views = pipeline.tta_views(inputs[0])
+    tta_ms = median_ms(lambda: model.predict(views), args.repeat)
+
+    print(f"{len(inputs)} images, {trials} perturbed trials, temperature {temperature:g}")
+    print(f"single pass: {single_ms:7.2f} ms, label flips {100 * flips[False] / trials:5.1f}%")
+    print(f"TTA ({len(views)} views): {tta_ms:7.2f} ms ({tta_ms / single_ms:.2f}x), "
+          f"label flips {100 * flips[True] / trials:5.1f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""Export skin_disease.h5 for the optimized inference backends.
+
+Usage:
+    python export_model.py [--model skin_disease.h5] [--variants float32 float16 dynamic int8]
+                           [--calibration-dir IMAGE_DIR] [--saved-model DIR]
+
+Variants:
+    float32  plain TFLite conversion
+    float16  weights stored as float16
+    dynamic  dynamic-range quantization (int8 weights, float activations)
+    int8     full integer quantization calibrated on --calibration-dir images
+             (inputs and outputs stay float32)
+
+Files are written next to the model as skin_disease.tflite,
+skin_disease_float16.tflite and so on; compare them against the .h5 model
+with compare_backends.py.
+"""
+import argparse
+import os
+
+import numpy as np
+import tensorflow as tf
+from PIL import Image
+
+from inference import MODEL_PATH, default_tflite_path
+
+VARIANTS = ("float32", "float16", "dynamic", "int8")
+
+
+def calibration_inputs(image_dir, limit=200):
+    """Model inputs for int8 calibration, built with the app's own preprocessing"""
+    from main import list_images, prepare_model_input
+
+    inputs = []
+    for path in list_images(image_dir):
+        with Image.open(path) as image:
+            *_, model_input = prepare_model_input(image.convert("RGB"), mode="fast", denoiser="bilateral")
+        if model_input is not None:
+            inputs.append(model_input.astype(np.float32))
+        if len(inputs) >= limit:
+            break
+    if not inputs:
+        raise SystemExit(f"No usable calibration images in {image_dir}")
+    return inputs
+
+
+def convert(model, variant, calibration=None):
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if variant == "float16":
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.target_spec.supported_types = [tf.float16]
+    elif variant == "dynamic":
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    elif variant == "int8":
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = lambda: ([x] for x in calibration)
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    return converter.convert()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--model", default=MODEL_PATH)
+    parser.add_argument("--variants", nargs="+", choices=VARIANTS, default=["float32", "float16", "dynamic"])
+    parser.add_argument("--calibration-dir", help="sample images for int8 calibration")
+    parser.add_argument("--saved-model", help="also write a SavedModel to this directory")
+    args = parser.parse_args()
+
+    if "int8" in args.variants and not args.calibration_dir:
+        parser.error("the int8 variant needs --calibration-dir")
+
+    model = tf.keras.models.load_model(args.model)
+    calibration = calibration_inputs(args.calibration_dir) if "int8" in args.variants else None
+
+    for variant in args.variants:
+        path = default_tflite_path(args.model, variant)
+        with open(path, "wb") as f:
+            f.write(convert(model, variant, calibration))
+        print(f"{variant:>8}: {path} ({os.path.getsize(path) / 2**20:.1f} MB)")
+
+    if args.saved_model:
+        tf.saved_model.save(model, args.saved_model)
+        print(f"SavedModel: {args.saved_model}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+"""Model loading and inference backends for the skin disease classifier.
+
+TensorFlow is imported lazily so the UI and headless tools start without
+paying for it until a model is actually needed.
+
+Backends share one interface: ``predict(batch)`` takes a float32
+``(N, 224, 224, 3)`` array and returns ``(N, num_classes)`` probabilities.
+
+- ``keras``: ``model.predict`` on the .h5 model
+- ``function``: the .h5 model called through a compiled ``tf.function``
+- ``tflite``: a TFLite interpreter (XNNPACK, multi-threaded) on a file
+  produced by export_model.py
+"""
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+MODEL_PATH = "skin_disease.h5"
+BACKENDS = ("keras", "function", "tflite")
+
+
+def default_tflite_path(model_path=MODEL_PATH, variant="float32"):
+    """Where export_model.py writes a TFLite variant of ``model_path``"""
+    base = os.path.splitext(model_path)[0]
+    return f"{base}.tflite" if variant == "float32" else f"{base}_{variant}.tflite"
+
+
+class KerasBackend:
+    name = "keras"
+
+    def __init__(self, model):
+        self.model = model
+        self.input_shape = tuple(model.input_shape[1:])
+
+    def predict(self, batch):
+        return self.model.predict(batch, verbose=0)
+
+
+class FunctionBackend:
+    """Calls the Keras model through a traced tf.function, skipping predict()'s per-call setup"""
+    name = "function"
+
+    def __init__(self, model):
+        import tensorflow as tf
+        self.model = model
+        self.input_shape = tuple(model.input_shape[1:])
+        self._call = tf.function(
+            lambda x: model(x, training=False),
+            input_signature=[tf.TensorSpec((None,) + self.input_shape, tf.float32)]
+        )
+
+    def predict(self, batch):
+        return self._call(np.asarray(batch, dtype=np.float32)).numpy()
+
+
+class TFLiteBackend:
+    """TFLite interpreter; float32 in and out, quantizing at the boundary when needed"""
+    name = "tflite"
+
+    def __init__(self, path, num_threads=None):
+        try:
+            from ai_edge_litert.interpreter import Interpreter
+        except ImportError:
+            import tensorflow as tf
+            Interpreter = tf.lite.Interpreter
+        self.path = path
+        self.interpreter = Interpreter(model_path=path, num_threads=num_threads or os.cpu_count())
+        self.interpreter.allocate_tensors()
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]
+        self.input_shape = tuple(int(d) for d in self._input["shape"][1:])
+        self._batch_size = int(self._input["shape"][0])
+        self._lock = threading.Lock()
+
+    def predict(self, batch):
+        batch = np.asarray(batch, dtype=np.float32)
+        with self._lock:
+            if batch.shape[0] != self._batch_size:
+                self.interpreter.resize_tensor_input(self._input["index"], batch.shape)
+                self.interpreter.allocate_tensors()
+                self._input = self.interpreter.get_input_details()[0]
+                self._output = self.interpreter.get_output_details()[0]
+                self._batch_size = batch.shape[0]
+
+            if self._input["dtype"] != np.float32:
+                scale, zero_point = self._input["quantization"]
+                batch = np.round(batch / scale + zero_point).astype(self._input["dtype"])
+            self.interpreter.set_tensor(self._input["index"], batch)
+            self.interpreter.invoke()
+            output = self.interpreter.get_tensor(self._output["index"])
+
+        if self._output["dtype"] != np.float32:
+            scale, zero_point = self._output["quantization"]
+            output = (output.astype(np.float32) - zero_point) * scale
+        return output
+
+
+def load_backend(backend="keras", model_path=MODEL_PATH, tflite_path=None, num_threads=None):
+    """Build the named inference backend"""
+    if backend == "tflite":
+        return TFLiteBackend(tflite_path or default_tflite_path(model_path), num_threads=num_threads)
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown inference backend: {backend}")
+
+    import tensorflow as tf
+    model = tf.keras.models.load_model(model_path)
+    if backend == "function":
+        return FunctionBackend(model)
+    return KerasBackend(model)
+
+
+class ModelLoader:
+    """Imports TensorFlow, loads a backend and runs a warm-up inference off the calling thread
+
+    ``model`` is the loaded backend. ``metrics`` holds the import, load and
+    warm-up times in seconds once loading finishes; ``error`` holds the
+    exception if it failed.
+    """
+
+    def __init__(self, path=MODEL_PATH, backend="keras", tflite_path=None, num_threads=None):
+        self.path = path
+        self.backend = backend
+        self.tflite_path = tflite_path
+        self.num_threads = num_threads
+        self.model = None
+        self.error = None
+        self.metrics = {}
+        self._ready = threading.Event()
+        self._started = False
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self):
+        return self._ready.is_set()
+
+    def start(self):
+        """Begin loading in a background thread (no-op if already started)"""
+        with self._lock:
+            if not self._started:
+                self._started = True
+                threading.Thread(target=self._load, name="model-loader", daemon=True).start()
+        return self
+
+    def get(self, timeout=None):
+        """Block until loading finishes and return the model (None on failure)"""
+        self.start()
+        self._ready.wait(timeout)
+        return self.model
+
+    def _load(self):
+        try:
+            start = time.perf_counter()
+            if self.backend != "tflite":
+                import tensorflow  # noqa: F401 -- timed apart from the model load
+            imported = time.perf_counter()
+            model = load_backend(self.backend, self.path, self.tflite_path, self.num_threads)
+            loaded = time.perf_counter()
+            # Trace the predict graph now so the first real upload doesn't pay for it
+            model.predict(np.zeros((1,) + model.input_shape, dtype=np.float32))
+            warmed = time.perf_counter()
+
+            self.metrics = {
+                "backend": self.backend,
+                "tensorflow_import_s": imported - start,
+                "model_load_s": loaded - imported,
+                "warmup_s": warmed - loaded,
+            }
+            self.model = model
+            logger.info("Startup metrics: %s", self.metrics)
+        except Exception as e:
+            self.error = e
+            logger.exception("Failed to load %s backend from %s", self.backend, self.path)
+        finally:
+            self._ready.set()
@@ -0,0 +1,254 @@
+"""Standalone HTTP inference service with dynamic micro-batching.
+
+Usage:
+    python inference_server.py [--port 8500] [--max-batch-size 32] [--max-wait-ms 10]
+
+Endpoints:
+    POST /predict?mode=fast&denoiser=bilateral   body: raw image bytes
+    GET  /health                                 queue and batching stats
+    GET  /metrics                                per-stage Prometheus metrics
+
+Requests are preprocessed on a thread pool, then queued for the model as
+uint8 inputs. The batcher waits up to --max-wait-ms for up to
+--max-batch-size inputs, normalizes them into one reused buffer and runs
+them through a single ``predict`` call. Once --max-pending requests are in
+flight, new ones get 503 with Retry-After until the queue drains.
+
+Point the Streamlit app at it with INFERENCE_SERVER_URL=http://host:8500.
+"""
+import argparse
+import asyncio
+import io
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+from PIL import Image, UnidentifiedImageError
+
+import main as pipeline
+from instrumentation import METRICS, enable_memory_tracing, stage, traced_request
+
+logger = logging.getLogger("inference_server")
+
+MAX_BODY_BYTES = 50 * 1024 * 1024
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 413: "Payload Too Large",
+           500: "Internal Server Error", 503: "Service Unavailable"}
+
+
+class MicroBatcher:
+    """Coalesces queued model inputs into batched predict calls"""
+
+    def __init__(self, model, max_batch_size=32, max_wait=0.01):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.queue = asyncio.Queue()
+        # Batches are normalized into one reused buffer; only one is in flight at a time
+        size = pipeline.MODEL_INPUT_SIZE
+        self.buffer = np.empty((max_batch_size, size, size, 3), dtype=np.float32)
+        # One thread keeps predict calls serialized; TF parallelizes inside each call
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="predict")
+        self.batches = 0
+        self.items = 0
+
+    async def predict(self, model_input):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((model_input, future))
+        return await future
+
+    def _predict(self, inputs):
+        with stage("predict"):
+            return pipeline.apply_temperature(self.model.predict(inputs), pipeline.load_temperature())
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            inputs = pipeline.preprocess_for_model_batch([model_input[0] for model_input, _ in batch],
+                                                         out=self.buffer)
+            try:
+                outputs = await loop.run_in_executor(self.executor, self._predict, inputs)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            self.batches += 1
+            self.items += len(batch)
+            for (_, future), output in zip(batch, outputs):
+                if not future.done():
+                    future.set_result(output)
+
+
+class InferenceServer:
+    def __init__(self, model, args):
+        self.args = args
+        self.batcher = MicroBatcher(model, args.max_batch_size, args.max_wait_ms / 1000)
+        self.preprocess_pool = ThreadPoolExecutor(max_workers=args.workers, thread_name_prefix="preprocess")
+        self.pending = 0
+        self.rejected = 0
+
+    def preprocess(self, data, mode, denoiser):
+        with traced_request():
+            try:
+                with stage("decode"):
+                    analysis = pipeline.ImageAnalysis(pipeline.load_image(io.BytesIO(data), mode=mode))
+            except Image.DecompressionBombError:
+                return "too_large", 0.0, None
+            except (UnidentifiedImageError, OSError):
+                return "unreadable", 0.0, None
+            with stage("validate"):
+                is_valid = pipeline.validate_image(analysis)
+            if not is_valid:
+                return "invalid", 0.0, None
+            *_, disease_percent, model_input = pipeline.prepare_model_input(
+                analysis, mode=mode, denoiser=denoiser, keep_processed=False, normalize=False
+            )
+        return "ok", disease_percent, model_input
+
+    async def predict(self, data, query):
+        mode = query.get("mode", [self.args.mode])[0]
+        denoiser = query.get("denoiser", [self.args.denoiser])[0]
+        if mode not in pipeline.PREPROCESS_MODES or denoiser not in pipeline.DENOISERS:
+            return 400, {"error": "unknown mode or denoiser"}
+
+        loop = asyncio.get_running_loop()
+        status, disease_percent, model_input = await loop.run_in_executor(
+            self.preprocess_pool, self.preprocess, data, mode, denoiser
+        )
+        if status == "unreadable":
+            return 400, {"error": "body is not a readable image"}
+        if status == "too_large":
+            return 413, {"error": f"image is over the {pipeline.PIXEL_BUDGET} pixel budget"}
+        predictions = None
+        if model_input is not None:
+            predictions = await self.batcher.predict(model_input)
+        return 200, pipeline.describe_result(disease_percent, predictions, status)
+
+    def health(self):
+        batches = self.batcher.batches
+        return 200, {
+            "status": "ok",
+            "pending": self.pending,
+            "queued": self.batcher.queue.qsize(),
+            "rejected": self.rejected,
+            "batches": batches,
+            "mean_batch_size": self.batcher.items / batches if batches else 0.0,
+        }
+
+    async def handle(self, reader, writer):
+        try:
+            status, payload, headers = await self.dispatch(reader)
+        except Exception as e:
+            logger.exception("Request failed")
+            status, payload, headers = 500, {"error": str(e)}, {}
+        if isinstance(payload, str):
+            body, content_type = payload.encode(), "text/plain; version=0.0.4"
+        else:
+            body, content_type = json.dumps(payload, ensure_ascii=False).encode(), "application/json"
+        head = [f"HTTP/1.1 {status} {REASONS.get(status, '')}",
+                f"Content-Type: {content_type}",
+                f"Content-Length: {len(body)}",
+                "Connection: close"]
+        head.extend(f"{k}: {v}" for k, v in headers.items())
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode() + body)
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def dispatch(self, reader):
+        request_line = await reader.readline()
+        try:
+            method, target, _ = request_line.decode("latin-1").split(" ", 2)
+        except ValueError:
+            return 400, {"error": "malformed request line"}, {}
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        url = urlsplit(target)
+        if method == "GET" and url.path == "/health":
+            return (*self.health(), {})
+        if method == "GET" and url.path == "/metrics":
+            return 200, METRICS.prometheus(), {}
+        if method != "POST" or url.path != "/predict":
+            return 404, {"error": "not found"}, {}
+
+        length = int(headers.get("content-length", 0))
+        if length <= 0:
+            return 400, {"error": "empty body"}, {}
+        if length > MAX_BODY_BYTES:
+            return 413, {"error": "image too large"}, {}
+        if self.pending >= self.args.max_pending:
+            self.rejected += 1
+            return 503, {"error": "server busy"}, {"Retry-After": "1"}
+
+        self.pending += 1
+        try:
+            data = await reader.readexactly(length)
+            return (*await self.predict(data, parse_qs(url.query)), {})
+        finally:
+            self.pending -= 1
+
+
+async def serve(args):
+    model = pipeline.load_model()
+    if model is None:
+        raise SystemExit("Model could not be loaded")
+
+    server = InferenceServer(model, args)
+    batch_task = asyncio.create_task(server.batcher.run())
+    listener = await asyncio.start_server(server.handle, args.host, args.port)
+    logger.info("Listening on http://%s:%d", args.host, args.port)
+    try:
+        async with listener:
+            await listener.serve_forever()
+    finally:
+        batch_task.cancel()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8500)
+    parser.add_argument("--max-batch-size", type=int, default=32)
+    parser.add_argument("--max-wait-ms", type=float, default=10.0)
+    parser.add_argument("--max-pending", type=int, default=256,
+                        help="requests in flight before new ones are rejected with 503")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="preprocessing threads")
+    parser.add_argument("--mode", choices=pipeline.PREPROCESS_MODES, default="fast")
+    parser.add_argument("--denoiser", choices=pipeline.DENOISERS, default="bilateral")
+    parser.add_argument("--trace-memory", action="store_true", help="record peak allocation per stage")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    if args.trace_memory:
+        enable_memory_tracing()
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""Per-stage timing and memory instrumentation for the analysis pipeline.
+
+Wrap each pipeline stage in ``with stage("name"):`` and each upload in
+``with traced_request() as trace:``. Every stage records wall time, CPU time
+(of the calling thread) and, while tracemalloc is tracing, peak Python/NumPy
+allocation. Samples feed process-wide histograms in ``METRICS``, which can
+be rendered as Prometheus text or summarized as p50/p95 per stage; each
+finished request is also logged as one JSON line on the
+``pipeline.metrics`` logger.
+
+Peak allocation uses tracemalloc's global peak, so it is exact for one
+request at a time and approximate when requests overlap.
+"""
+import contextvars
+import json
+import logging
+import threading
+import time
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+
+logger = logging.getLogger("pipeline.metrics")
+
+# Histogram bucket upper bounds, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Recent samples kept per stage for percentiles
+WINDOW = 1000
+
+_current_trace = contextvars.ContextVar("pipeline_trace", default=None)
+
+
+class RequestTrace:
+    """Stage samples for one upload"""
+
+    def __init__(self):
+        self.stages = {}
+        self.started = time.perf_counter()
+        self.total_s = None
+
+    def add(self, name, wall, cpu, peak):
+        self.stages[name] = {
+            "wall_ms": round(wall * 1000, 3),
+            "cpu_ms": round(cpu * 1000, 3),
+            "peak_kb": None if peak is None else round(peak / 1024, 1),
+        }
+
+    def as_dict(self):
+        return {"total_ms": None if self.total_s is None else round(self.total_s * 1000, 3),
+                "stages": self.stages}
+
+
+class StageMetrics:
+    """Thread-safe per-stage histograms and recent-sample windows"""
+
+    def __init__(self, buckets=BUCKETS, window=WINDOW):
+        self.buckets = buckets
+        self.window = window
+        self._stages = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name, wall, cpu, peak=None):
+        with self._lock:
+            entry = self._stages.get(name)
+            if entry is None:
+                entry = self._stages[name] = {
+                    "buckets": [0] * len(self.buckets),
+                    "count": 0,
+                    "wall_sum": 0.0,
+                    "cpu_sum": 0.0,
+                    "peak_max": 0,
+                    "recent": deque(maxlen=self.window),
+                }
+            for i, bound in enumerate(self.buckets):
+                if wall <= bound:
+                    entry["buckets"][i] += 1
+            entry["count"] += 1
+            entry["wall_sum"] += wall
+            entry["cpu_sum"] += cpu
+            if peak is not None:
+                entry["peak_max"] = max(entry["peak_max"], peak)
+            entry["recent"].append(wall)
+
+    def summary(self):
+        """p50/p95 wall time, mean CPU time and max peak allocation per stage"""
+        with self._lock:
+            rows = {}
+            for name, entry in self._stages.items():
+                recent = np.array(entry["recent"]) * 1000
+                rows[name] = {
+                    "count": entry["count"],
+                    "p50_ms": round(float(np.percentile(recent, 50)), 3),
+                    "p95_ms": round(float(np.percentile(recent, 95)), 3),
+                    "cpu_mean_ms": round(entry["cpu_sum"] / entry["count"] * 1000, 3),
+                    "peak_max_kb": round(entry["peak_max"] / 1024, 1),
+                }
+            return rows
+
+    def prometheus(self, prefix="skin_pipeline"):
+        """Prometheus text exposition of every stage"""
+        lines = [
+            f"# HELP {prefix}_stage_seconds Wall time per pipeline stage.",
+            f"# TYPE {prefix}_stage_seconds histogram",
+        ]
+        with self._lock:
+            stages = sorted(self._stages.items())
+            for name, entry in stages:
+                for bound, count in zip(self.buckets, entry["buckets"]):
+                    lines.append(f'{prefix}_stage_seconds_bucket{{stage="{name}",le="{bound}"}} {count}')
+                lines.append(f'{prefix}_stage_seconds_bucket{{stage="{name}",le="+Inf"}} {entry["count"]}')
+                lines.append(f'{prefix}_stage_seconds_sum{{stage="{name}"}} {entry["wall_sum"]}')
+                lines.append(f'{prefix}_stage_seconds_count{{stage="{name}"}} {entry["count"]}')
+            lines.append(f"# HELP {prefix}_stage_cpu_seconds_total CPU time per pipeline stage.")
+            lines.append(f"# TYPE {prefix}_stage_cpu_seconds_total counter")
+            for name, entry in stages:
+                lines.append(f'{prefix}_stage_cpu_seconds_total{{stage="{name}"}} {entry["cpu_sum"]}')
+            lines.append(f"# HELP {prefix}_stage_peak_bytes Largest traced allocation peak per stage.")
+            lines.append(f"# TYPE {prefix}_stage_peak_bytes gauge")
+            for name, entry in stages:
+                lines.append(f'{prefix}_stage_peak_bytes{{stage="{name}"}} {entry["peak_max"]}')
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._stages.clear()
+
+
+METRICS = StageMetrics()
+
+
+def enable_memory_tracing():
+    """Start tracemalloc so stages also record peak allocation"""
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+@contextmanager
+def stage(name, metrics=METRICS):
+    """Time one pipeline stage (stages must not be nested)"""
+    tracing_memory = tracemalloc.is_tracing()
+    if tracing_memory:
+        tracemalloc.reset_peak()
+        start_memory = tracemalloc.get_traced_memory()[0]
+    start_wall = time.perf_counter()
+    start_cpu = time.thread_time()
+    try:
+        yield
+    finally:
+        wall = time.perf_counter() - start_wall
+        cpu = time.thread_time() - start_cpu
+        peak = tracemalloc.get_traced_memory()[1] - start_memory if tracing_memory else None
+        metrics.observe(name, wall, cpu, peak)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add(name, wall, cpu, peak)
+
+
+@contextmanager
+def traced_request():
+    """Collect the stages of one upload into a RequestTrace and log it as JSON"""
+    trace = RequestTrace()
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+        trace.total_s = time.perf_counter() - trace.started
+        logger.info(json.dumps(trace.as_dict()))
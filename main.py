@@ -1,10 +1,23 @@
 import streamlit as st
-import tensorflow as tf
 import numpy as np
 from PIL import Image
 import cv2
+import json
+import logging
+import math
 import os
-import matplotlib.pyplot as plt
+import time
+import urllib.request
+from collections import namedtuple
+from functools import cached_property, lru_cache
+from urllib.parse import urlencode
+
+from inference import MODEL_PATH, ModelLoader, default_tflite_path
+from instrumentation import METRICS, enable_memory_tracing, stage, traced_request
+from prediction_store import DEFAULT_MAX_DISTANCE, DEFAULT_STORE_PATH, PredictionStore, file_digest, image_fingerprint
+from result_cache import DEFAULT_MAX_BYTES, DEFAULT_MAX_ENTRIES, ResultCache, content_key
+
+logger = logging.getLogger("pipeline")
 
 # Set page config
 st.set_page_config(
@@ -55,18 +68,51 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 
-# Load model with caching
+# Model loader shared by all sessions; TensorFlow is imported on its thread
 @st.cache_resource
+def get_model_loader():
+    return ModelLoader(
+        MODEL_PATH,
+        backend=os.environ.get("INFERENCE_BACKEND", "keras"),
+        tflite_path=os.environ.get("TFLITE_MODEL"),
+        num_threads=int(os.environ["TFLITE_THREADS"]) if os.environ.get("TFLITE_THREADS") else None
+    )
+
+
 def load_model():
-    try:
-        model = tf.keras.models.load_model('skin_disease.h5')
-        return model
-    except Exception as e:
-        st.error(f"မော်ဒယ်ဖတ်ရှုရာတွင် အမှားတစ်ခုဖြစ်ပေါ်ခဲ့သည်: {str(e)}")
-        return None
+    """Wait for the model to finish loading and return its inference backend"""
+    loader = get_model_loader()
+    model = loader.get()
+    if loader.error is not None:
+        st.error(f"မော်ဒယ်ဖတ်ရှုရာတွင် အမှားတစ်ခုဖြစ်ပေါ်ခဲ့သည်: {str(loader.error)}")
+    return model
+
+
+# Result cache shared by all sessions, sized from the environment
+@st.cache_resource
+def get_result_cache():
+    return ResultCache(
+        max_bytes=int(os.environ.get("RESULT_CACHE_MAX_MB", DEFAULT_MAX_BYTES // 2**20)) * 2**20,
+        max_entries=int(os.environ.get("RESULT_CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES))
+    )
+
 
+# Persistent prediction store, tied to the model file this process loads;
+# disabled when PREDICTION_STORE is empty or the model file is missing
+@st.cache_resource
+def get_prediction_store():
+    path = os.environ.get("PREDICTION_STORE", DEFAULT_STORE_PATH)
+    loader = get_model_loader()
+    model_file = loader.path
+    if loader.backend == "tflite":
+        model_file = loader.tflite_path or default_tflite_path(loader.path)
+    if not path or not os.path.exists(model_file):
+        return None
+    return PredictionStore(
+        path, model_hash=file_digest(model_file),
+        max_distance=int(os.environ.get("PREDICTION_STORE_MAX_DISTANCE", DEFAULT_MAX_DISTANCE))
+    )
 
-model = load_model()
 
 # Class labels and disease information
 CLASS_NAMES = {
@@ -126,70 +172,249 @@ DISEASE_INFO = {
     }
 }
 
+# Preprocessing settings
+MODEL_INPUT_SIZE = 224
+# The ROI step uses an 11px adaptive threshold window, so the fast path keeps
+# a few times the model input size for lesion borders to survive.
+ROI_SCALE = 4
+PREPROCESS_MODES = ("full", "fast")
+DENOISERS = ("nlmeans", "bilateral", "median", "gaussian")
+# Image files the uploader accepts and the command-line tools pick up from directories
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+# Predictions below this confidence (%) are reported as healthy skin
+CONFIDENCE_THRESHOLD = 70
+# Contours smaller than this fraction of the image are treated as noise
+MIN_LESION_AREA = 0.005
+# Multi-lesion mode: lesions classified per image and context kept around each crop
+MAX_LESIONS = 5
+LESION_CROP_MARGIN = 0.1
+# Seconds to wait for inference_server.py
+REMOTE_TIMEOUT = 60
+# Border trimmed by the center-crop test-time augmentation view, per side
+TTA_CROP_MARGIN = 0.05
+# Temperature-scaling calibration written by calibrate.py
+CALIBRATION_FILE = os.environ.get("CALIBRATION_FILE", "calibration.json")
+
+
+# Webcam index or video file for the "Live camera" input. It is opened on the
+# machine running the app, so the input only exists when the operator sets this
+LIVE_CAMERA_SOURCE = os.environ.get("LIVE_CAMERA_SOURCE")
+
+# Largest decoded image, in pixels, one upload may hold in memory
+PIXEL_BUDGET = int(os.environ.get("PIXEL_BUDGET", 24_000_000))
+
+# Skin color range in HSV
+LOWER_SKIN = np.array([0, 48, 80], dtype=np.uint8)
+UPPER_SKIN = np.array([20, 255, 255], dtype=np.uint8)
+# Most pixels converted to HSV at once; larger images are measured in bands of rows
+SKIN_CHUNK_PIXELS = 1_000_000
+
+
+def load_image(source, mode="full", pixel_budget=None):
+    """Decode an upload into a single array no larger than the pixel budget
+
+    JPEGs are decoded at a reduced DCT scale (PIL draft mode) when the full
+    size isn't needed: in fast mode anything beyond the working size, in any
+    mode anything beyond the budget. Whatever still exceeds the budget after
+    decoding is resized down to it. Other formats can only be decoded whole,
+    so those over the budget raise Image.DecompressionBombError before any
+    pixel is decoded.
+    """
+    if pixel_budget is None:
+        pixel_budget = PIXEL_BUDGET
+    with Image.open(source) as image:
+        width, height = image.size
+        if image.format != "JPEG" and width * height > pixel_budget:
+            raise Image.DecompressionBombError(
+                f"{image.format} image of {width}x{height} pixels is over the {pixel_budget} pixel budget"
+            )
+        target_h, target_w = plan_working_size(height, width) if mode == "fast" else (height, width)
+        if target_h * target_w > pixel_budget:
+            scale = math.sqrt(pixel_budget / (target_h * target_w))
+            target_h, target_w = int(target_h * scale), int(target_w * scale)
+
+        if image.format == "JPEG" and (target_h, target_w) != (height, width):
+            # Picks the smallest DCT scale that still covers the target size
+            image.draft("RGB", (target_w, target_h))
+
+        if image.mode not in ("RGB", "RGBA", "L"):
+            image = image.convert("RGB")
+        if image.width * image.height > pixel_budget:
+            # Scale to the budget itself; an integer reduce() can land far below it
+            scale = math.sqrt(pixel_budget / (image.width * image.height))
+            size = (max(1, int(image.width * scale)), max(1, int(image.height * scale)))
+            image = image.resize(size, Image.Resampling.LANCZOS, reducing_gap=2.0)
+        return np.asarray(image)
+
+
+class ImageAnalysis:
+    """Per-upload image state: converted once, derived values computed on first use
+
+    Only the RGB and grayscale arrays the later stages reuse are kept; the
+    skin check keeps its percentage, not its HSV image and mask.
+    """
+
+    def __init__(self, image):
+        if isinstance(image, Image.Image):
+            image = np.asarray(image)
+        self.source = image
+        self.shape = image.shape
+        self.is_color = image.ndim == 3
+        self.is_valid = None
+        # ROI outline as (K, 2) fractions of width and height, set by remove_background_and_focus_roi
+        self.roi_contour = None
+        # (contour, area) pairs that remove_background_and_focus_roi found, largest first
+        self.lesion_contours = None
+
+    @cached_property
+    def rgb(self):
+        img = self.source
+        if img.ndim == 2:  # Grayscale
+            return cv2.cvtColor(img, cv2.COLOR_GRAY2RGB)
+        if img.shape[2] == 4:  # RGBA
+            return cv2.cvtColor(img, cv2.COLOR_RGBA2RGB)
+        return img
+
+    @cached_property
+    def gray(self):
+        return cv2.cvtColor(self.rgb, cv2.COLOR_RGB2GRAY)
+
+    @cached_property
+    def skin_percentage(self):
+        return skin_percentages([self.rgb])[0]
+
+
 def validate_image(image):
+    """Check size and skin content; results are cached on an ImageAnalysis"""
     if image is None:
         st.warning("ဓာတ်ပုံမတွေ့ပါ")
         return False
     try:
-        if isinstance(image, Image.Image):
-            img_array = np.array(image)
-        else:
-            img_array = image
+        analysis = image if isinstance(image, ImageAnalysis) else ImageAnalysis(image)
+        if analysis.is_valid is not None:
+            return analysis.is_valid
+        analysis.is_valid = False
 
         # Check for minimum dimensions
-        if img_array.shape[0] < 50 or img_array.shape[1] < 50:
+        if analysis.shape[0] < 50 or analysis.shape[1] < 50:
             st.warning("ဓာတ်ပုံအရွယ်အစား အလွန်သေးငယ်နေပါသည် (အနည်းဆုံး 50x50 pixels လိုအပ်ပါသည်)")
             return False
 
-        # Skin detection for color images
-        if len(img_array.shape) == 3:  # Color image
-            # Convert to HSV color space
-            hsv = cv2.cvtColor(img_array, cv2.COLOR_RGB2HSV)
-
-            # Define skin color range in HSV
-            lower_skin = np.array([0, 48, 80], dtype=np.uint8)
-            upper_skin = np.array([20, 255, 255], dtype=np.uint8)
-
-            # Create mask
-            skin_mask = cv2.inRange(hsv, lower_skin, upper_skin)
-
-            # Calculate percentage of skin pixels
-            skin_pixels = cv2.countNonZero(skin_mask)
-            total_pixels = img_array.shape[0] * img_array.shape[1]
-            skin_percentage = (skin_pixels / total_pixels) * 100
-
-            # If less than 5% of the image contains skin-like colors
-            if skin_percentage < 5:
-                st.markdown(
-                    '<div class="skin-warning">⚠️ ဤဓာတ်ပုံတွင် အရေပြားမပါဝင်ပါ (သို့) အရေပြားအစား အခြားအရာများပါဝင်နေပါသည်။ အရေပြားဓာတ်ပုံတင်ပေးပါ။</div>',
-                    unsafe_allow_html=True)
-                return False
+        # If less than 5% of a color image contains skin-like colors
+        if analysis.is_color and analysis.skin_percentage < 5:
+            st.markdown(
+                '<div class="skin-warning">⚠️ ဤဓာတ်ပုံတွင် အရေပြားမပါဝင်ပါ (သို့) အရေပြားအစား အခြားအရာများပါဝင်နေပါသည်။ အရေပြားဓာတ်ပုံတင်ပေးပါ။</div>',
+                unsafe_allow_html=True)
+            return False
 
+        analysis.is_valid = True
         return True
     except Exception as e:
         st.error(f"ဓာတ်ပုံ စစ်ဆေးရာတွင် အမှားတစ်ခုဖြစ်နေသည်: {str(e)}")
         return False
 
-def apply_advanced_preprocessing(image):
-    """Enhanced preprocessing pipeline"""
+
+def skin_percentages(images):
+    """Skin percentage of each image
+
+    ``images`` are RGB arrays or ImageAnalysis objects. Each one is converted
+    to HSV and masked in bands of rows of at most SKIN_CHUNK_PIXELS, into one
+    HSV buffer and one mask allocated for the whole batch, so the check needs
+    a few MB of scratch memory however large the photos are.
+    """
+    rgb = [image.rgb if isinstance(image, ImageAnalysis) else image for image in images]
+    band_rows = [min(img.shape[0], max(1, SKIN_CHUNK_PIXELS // img.shape[1])) for img in rgb]
+    largest = max((rows * img.shape[1] for rows, img in zip(band_rows, rgb)), default=0)
+    hsv_buffer = np.empty(largest * 3, dtype=np.uint8)
+    mask_buffer = np.empty(largest, dtype=np.uint8)
+    percentages = []
+    for img, rows in zip(rgb, band_rows):
+        height, width = img.shape[:2]
+        skin_pixels = 0
+        for top in range(0, height, rows):
+            band = img[top:top + rows]
+            size = band.shape[0] * width
+            hsv = cv2.cvtColor(band, cv2.COLOR_RGB2HSV, dst=hsv_buffer[:size * 3].reshape(band.shape))
+            skin_mask = cv2.inRange(hsv, LOWER_SKIN, UPPER_SKIN, dst=mask_buffer[:size].reshape(band.shape[:2]))
+            skin_pixels += cv2.countNonZero(skin_mask)
+        percentages.append(skin_pixels / (height * width) * 100)
+    return percentages
+
+
+def validate_images(images):
+    """Batch form of validate_image for headless callers; returns one bool per image
+
+    Shows no warnings. Skin percentages come from one skin_percentages call
+    and, like the result, are cached on any ImageAnalysis passed in.
+    """
+    analyses = [image if isinstance(image, ImageAnalysis) else ImageAnalysis(image) for image in images]
+    pending = [analysis for analysis in analyses if analysis.is_valid is None]
+    for analysis in pending:
+        analysis.is_valid = analysis.shape[0] >= 50 and analysis.shape[1] >= 50
+
+    unmeasured = [analysis for analysis in pending
+                  if analysis.is_valid and analysis.is_color and "skin_percentage" not in vars(analysis)]
+    for analysis, percentage in zip(unmeasured, skin_percentages(unmeasured)):
+        analysis.skin_percentage = percentage
+
+    for analysis in pending:
+        if analysis.is_valid and analysis.is_color:
+            analysis.is_valid = analysis.skin_percentage >= 5
+    return [analysis.is_valid for analysis in analyses]
+
+
+def plan_working_size(height, width, target_size=MODEL_INPUT_SIZE, roi_scale=ROI_SCALE):
+    """Bounded working resolution for preprocessing (never upscales)"""
+    max_side = target_size * roi_scale
+    longest = max(height, width)
+    if longest <= max_side:
+        return height, width
+    scale = max_side / longest
+    return max(1, int(round(height * scale))), max(1, int(round(width * scale)))
+
+
+def denoise_image(img, denoiser="nlmeans"):
+    """Apply the selected denoiser to an RGB image"""
+    if denoiser == "nlmeans":
+        return cv2.fastNlMeansDenoisingColored(
+            img, None,
+            h=10, hColor=10,
+            templateWindowSize=7,
+            searchWindowSize=21
+        )
+    if denoiser == "bilateral":
+        return cv2.bilateralFilter(img, 9, 75, 75)
+    if denoiser == "median":
+        return cv2.medianBlur(img, 5)
+    if denoiser == "gaussian":
+        return cv2.GaussianBlur(img, (5, 5), 0)
+    raise ValueError(f"Unknown denoiser: {denoiser}")
+
+
+def apply_advanced_preprocessing(image, mode="full", denoiser="nlmeans"):
+    """Enhanced preprocessing pipeline
+
+    mode="full" works at the original resolution; mode="fast" first shrinks
+    the image to the planned working size (see plan_working_size).
+    """
     try:
-        if not validate_image(image):
+        analysis = image if isinstance(image, ImageAnalysis) else ImageAnalysis(image)
+        if not validate_image(analysis):
             return None
 
-        # Convert to numpy array if PIL Image
-        if isinstance(image, Image.Image):
-            img = np.array(image)
-        else:
-            img = image.copy()
+        img = analysis.rgb
 
-        # Handle different image formats
-        if len(img.shape) == 2:  # Grayscale
-            img = cv2.cvtColor(img, cv2.COLOR_GRAY2RGB)
-        elif img.shape[2] == 4:  # RGBA
-            img = cv2.cvtColor(img, cv2.COLOR_RGBA2RGB)
+        # Work at a bounded resolution in fast mode
+        if mode == "fast":
+            height, width = img.shape[:2]
+            work_h, work_w = plan_working_size(height, width)
+            if (work_h, work_w) != (height, width):
+                img = cv2.resize(img, (work_w, work_h), interpolation=cv2.INTER_AREA)
+        elif mode != "full":
+            raise ValueError(f"Unknown preprocessing mode: {mode}")
+        img = cv2.cvtColor(img, cv2.COLOR_RGB2LAB)
 
         # Color correction
-        img = cv2.cvtColor(img, cv2.COLOR_RGB2LAB)
         l, a, b = cv2.split(img)
         clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
         l = clahe.apply(l)
@@ -197,62 +422,89 @@ def apply_advanced_preprocessing(image):
         img = cv2.cvtColor(img, cv2.COLOR_LAB2RGB)
 
         # Smart denoising
-        img = cv2.fastNlMeansDenoisingColored(
-            img, None,
-            h=10, hColor=10,
-            templateWindowSize=7,
-            searchWindowSize=21
-        )
+        img = denoise_image(img, denoiser)
 
         return img
 
     except Exception as e:
         st.error(f"ဓာတ်ပုံပြင်ဆင်ရာတွင် အမှားတစ်ခုဖြစ်နေသည်: {str(e)}")
         return None
-def remove_background_and_focus_roi(image):
-    """Improved ROI detection with better visualization and false positive reduction"""
-    try:
-        if not validate_image(image):
-            return None, 0.0
 
-        gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
 
-        # Adaptive thresholding
-        thresh = cv2.adaptiveThreshold(
-            gray, 255,
-            cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
-            cv2.THRESH_BINARY_INV,
-            11, 2
-        )
+def detect_lesion_contours(gray, max_lesions=1, image_area=None):
+    """Largest candidate lesion contours as (contour, area) pairs, biggest first
 
-        # Morphological operations
-        kernel = np.ones((3, 3), np.uint8)
-        cleaned = cv2.morphologyEx(thresh, cv2.MORPH_CLOSE, kernel, iterations=2)
-        cleaned = cv2.morphologyEx(cleaned, cv2.MORPH_OPEN, kernel, iterations=1)
+    ``image_area`` sets the noise floor when ``gray`` is a window cut from a
+    larger frame; it defaults to the area of ``gray`` itself.
+    """
+    # Adaptive thresholding
+    thresh = cv2.adaptiveThreshold(
+        gray, 255,
+        cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+        cv2.THRESH_BINARY_INV,
+        11, 2
+    )
 
-        contours, _ = cv2.findContours(cleaned, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    # Morphological operations
+    kernel = np.ones((3, 3), np.uint8)
+    cleaned = cv2.morphologyEx(thresh, cv2.MORPH_CLOSE, kernel, iterations=2)
+    cleaned = cv2.morphologyEx(cleaned, cv2.MORPH_OPEN, kernel, iterations=1)
 
-        if not contours:
-            return None, 0.0
+    contours, _ = cv2.findContours(cleaned, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
 
-        # FIX 1: Ignore tiny noise areas (< 0.5% of image area)
+    # FIX 1: Ignore tiny noise areas (< 0.5% of image area)
+    if image_area is None:
         image_area = gray.shape[0] * gray.shape[1]
-        contours = [c for c in contours if cv2.contourArea(c) > 0.005 * image_area]
-        if not contours:
+    min_area = MIN_LESION_AREA * image_area
+    lesions = []
+    for contour in contours:
+        area = cv2.contourArea(contour)
+        if area > min_area:
+            lesions.append((contour, area))
+
+    lesions.sort(key=lambda lesion: lesion[1], reverse=True)
+    return lesions[:max_lesions]
+
+
+def remove_background_and_focus_roi(image, analysis=None, in_place=False, max_lesions=1):
+    """Improved ROI detection with better visualization and false positive reduction
+
+    ``analysis`` is the ImageAnalysis of the upload ``image`` was derived
+    from; when given, its validation and grayscale are reused, and the up to
+    ``max_lesions`` contours found are kept in ``analysis.lesion_contours``
+    for lesion_model_inputs. With ``in_place`` the outline is drawn on
+    ``image`` itself instead of a copy.
+    """
+    try:
+        if not validate_image(analysis if analysis is not None else image):
             return None, 0.0
 
-        largest_contour = max(contours, key=cv2.contourArea)
+        if analysis is not None and image is analysis.rgb:
+            gray = analysis.gray
+        else:
+            gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
 
-        mask = np.zeros_like(gray)
-        cv2.drawContours(mask, [largest_contour], -1, 255, thickness=cv2.FILLED)
+        lesions = detect_lesion_contours(gray, max_lesions=max_lesions)
+        if analysis is not None:
+            analysis.lesion_contours = lesions
+        if not lesions:
+            return None, 0.0
+        largest_contour = lesions[0][0]
+        if analysis is not None:
+            analysis.roi_contour = largest_contour[:, 0] / np.array([gray.shape[1], gray.shape[0]], dtype=np.float32)
+
+        # Fill the contour in a mask covering only its bounding box
+        x, y, w, h = cv2.boundingRect(largest_contour)
+        mask = np.zeros((h, w), dtype=np.uint8)
+        cv2.drawContours(mask, [largest_contour], -1, 255, thickness=cv2.FILLED, offset=(-x, -y))
 
         # Calculate affected area percentage
         disease_pixels = np.count_nonzero(mask)
-        total_pixels = mask.shape[0] * mask.shape[1]
+        total_pixels = gray.shape[0] * gray.shape[1]
         disease_percentage = (disease_pixels / total_pixels) * 100
 
         # Visualization
-        visualization = image.copy()
+        visualization = image if in_place else image.copy()
         cv2.drawContours(visualization, [largest_contour], -1, (0, 255, 0), 2)
 
         return visualization, disease_percentage
@@ -262,23 +514,45 @@ def remove_background_and_focus_roi(image):
         return None, 0.0
 
 
-def preprocess_for_model(image):
-    """Final preprocessing for model input with validation"""
+def preprocess_for_model(image, analysis=None, normalize=True):
+    """Final preprocessing for model input with validation
+
+    ``analysis`` works as in remove_background_and_focus_roi; ``normalize``
+    as in preprocess_for_model_batch.
+    """
     try:
-        if not validate_image(image):
+        if not validate_image(analysis if analysis is not None else image):
             return None
+        return preprocess_for_model_batch([image], normalize=normalize)
+
+    except Exception as e:
+        st.error(f"မော်ဒယ်အတွက် ဓာတ်ပုံပြင်ဆင်ရာတွင် အမှားတစ်ခုဖြစ်နေသည်: {str(e)}")
+        return None
+
 
+def preprocess_for_model_batch(images, out=None, normalize=True):
+    """Letterbox RGB, RGBA or grayscale images into one (N, 224, 224, 3) model batch
+
+    Each image is resized straight into its slot of ``out``, which is
+    allocated when not given; a larger buffer can be reused across batches
+    and its first N slots are returned. With ``normalize`` the batch is
+    float32 scaled to [0, 1] in place, otherwise it stays uint8 for models
+    that rescale in their input layer. Images are not validated here.
+    """
+    target_size = MODEL_INPUT_SIZE
+    if out is None:
+        out = np.empty((len(images), target_size, target_size, 3), dtype=np.float32 if normalize else np.uint8)
+    batch = out[:len(images)]
+
+    for slot, image in zip(batch, images):
         # Convert to RGB if grayscale
-        if len(image.shape) == 2:
+        if image.ndim == 2:
             image = cv2.cvtColor(image, cv2.COLOR_GRAY2RGB)
         elif image.shape[2] == 4:
             image = image[:, :, :3]
 
         # Resize with aspect ratio preservation
         height, width = image.shape[:2]
-        target_size = 224
-
-        # Calculate padding
         if height > width:
             new_height = target_size
             new_width = int(width * (target_size / height))
@@ -286,45 +560,464 @@ def preprocess_for_model(image):
             new_width = target_size
             new_height = int(height * (target_size / width))
 
-        resized = cv2.resize(image, (new_width, new_height))
+        # Center in the slot and pad the rest with black
+        top, left = (target_size - new_height) // 2, (target_size - new_width) // 2
+        bottom, right = top + new_height, left + new_width
+        slot[:top] = 0
+        slot[bottom:] = 0
+        slot[top:bottom, :left] = 0
+        slot[top:bottom, right:] = 0
+        slot[top:bottom, left:right] = cv2.resize(image, (new_width, new_height))
 
-        # Pad to make square
-        delta_w = target_size - new_width
-        delta_h = target_size - new_height
-        top, bottom = delta_h // 2, delta_h - (delta_h // 2)
-        left, right = delta_w // 2, delta_w - (delta_w // 2)
+    # Normalize
+    if normalize:
+        np.divide(batch, 255.0, out=batch)
+    return batch
 
-        img = cv2.copyMakeBorder(
-            resized, top, bottom, left, right,
-            cv2.BORDER_CONSTANT, value=[0, 0, 0]
-        )
 
-        # Normalize
-        img = img.astype('float32') / 255.0
-        return np.expand_dims(img, axis=0)
+PipelineResult = namedtuple(
+    "PipelineResult",
+    ["processed_img", "roi_img", "disease_percent", "predictions", "lesions", "tta", "roi_contour"],
+    defaults=[None, None, None]
+)
 
-    except Exception as e:
-        st.error(f"မော်ဒယ်အတွက် ဓာတ်ပုံပြင်ဆင်ရာတွင် အမှားတစ်ခုဖြစ်နေသည်: {str(e)}")
+
+def tta_views(model_input):
+    """Flips, rotations and a center crop of a (1, S, S, 3) model input, stacked as one batch"""
+    img = model_input[0]
+    size = img.shape[0]
+    margin = int(size * TTA_CROP_MARGIN)
+    crop = cv2.resize(img[margin:size - margin, margin:size - margin], (size, size))
+    return np.stack([
+        img, img[:, ::-1], img[::-1],
+        np.rot90(img, 1), np.rot90(img, 2), np.rot90(img, 3),
+        crop,
+    ])
+
+
+def aggregate_tta(outputs):
+    """Mean probabilities over the TTA views, plus how much the views agree"""
+    predictions = outputs.mean(axis=0)
+    predicted_class = int(np.argmax(predictions))
+    stats = {
+        "views": len(outputs),
+        "agreement": float(np.mean(outputs.argmax(axis=1) == predicted_class) * 100),
+        "confidence_spread": float(outputs[:, predicted_class].std() * 100),
+    }
+    return predictions, stats
+
+
+def apply_temperature(predictions, temperature=1.0):
+    """Temperature-scale softmax outputs along the last axis"""
+    if temperature == 1.0:
+        return predictions
+    logits = np.log(np.clip(predictions, 1e-12, 1.0)) / temperature
+    logits -= logits.max(axis=-1, keepdims=True)
+    scaled = np.exp(logits)
+    return scaled / scaled.sum(axis=-1, keepdims=True)
+
+
+def load_temperature(path=CALIBRATION_FILE):
+    """Temperature fitted by calibrate.py, or 1.0 (uncalibrated) when there is none
+
+    Re-read whenever the file changes; an unreadable file also means 1.0.
+    """
+    try:
+        mtime_ns = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return 1.0
+    return _load_temperature(path, mtime_ns)
+
+
+@lru_cache(maxsize=8)
+def _load_temperature(path, mtime_ns):
+    try:
+        with open(path, encoding="utf-8") as f:
+            temperature = float(json.load(f)["temperature"])
+        if not math.isfinite(temperature) or temperature <= 0:
+            raise ValueError(f"temperature must be a positive number, got {temperature}")
+        return temperature
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        logger.warning("Ignoring calibration file %s: %s", path, e)
+        return 1.0
+
+
+def lesion_model_inputs(image, analysis=None, max_lesions=MAX_LESIONS, contours=None):
+    """Model inputs for each significant lesion in ``image``
+
+    ``contours`` are (contour, area) pairs already detected on ``image``,
+    such as ``analysis.lesion_contours``; without them lesions are detected
+    here. Returns (lesions, inputs): ``lesions`` is a list of dicts with the
+    contour, bounding box and area percentage, ``inputs`` the stacked
+    224x224 crops (None when nothing was found).
+    """
+    height, width = image.shape[:2]
+    if contours is None:
+        if analysis is not None and image is analysis.rgb:
+            gray = analysis.gray
+        else:
+            gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+        contours = detect_lesion_contours(gray, max_lesions=max_lesions)
+
+    lesions, crops = [], []
+    for contour, area in contours[:max_lesions]:
+        x, y, w, h = cv2.boundingRect(contour)
+        margin_x, margin_y = int(w * LESION_CROP_MARGIN), int(h * LESION_CROP_MARGIN)
+        x0, y0 = max(0, x - margin_x), max(0, y - margin_y)
+        x1, y1 = min(width, x + w + margin_x), min(height, y + h + margin_y)
+        lesions.append({
+            "contour": contour,
+            "bbox": (x0, y0, x1 - x0, y1 - y0),
+            "area_percent": area / (height * width) * 100,
+        })
+        crops.append(image[y0:y1, x0:x1])
+
+    # Crops are judged by the whole upload when its analysis is known, else one by one
+    if analysis is not None:
+        valid = [validate_image(analysis)] * len(crops)
+    else:
+        valid = validate_images(crops)
+    lesions = [lesion for lesion, ok in zip(lesions, valid) if ok]
+    crops = [crop for crop, ok in zip(crops, valid) if ok]
+    return lesions, (preprocess_for_model_batch(crops) if crops else None)
+
+
+def draw_lesions(image, lesions):
+    """Outline and number each lesion on a copy of ``image``"""
+    visualization = image.copy()
+    for number, lesion in enumerate(lesions, start=1):
+        x, y, w, h = lesion["bbox"]
+        cv2.drawContours(visualization, [lesion["contour"]], -1, (0, 255, 0), 2)
+        cv2.rectangle(visualization, (x, y), (x + w, y + h), (255, 255, 0), 2)
+        cv2.putText(visualization, str(number), (x + 4, y + 24),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 255, 0), 2)
+    return visualization
+
+
+def summarize_prediction(predictions):
+    """Predicted class index and confidence percentage shown to the user"""
+    predicted_class = int(np.argmax(predictions))
+    confidence = float(np.max(predictions)) * 100
+    if confidence > 99:
+        confidence = 100
+    return predicted_class, confidence
+
+
+def shown_label(predictions, disease_percent=None):
+    """Class index shown to the user, or None for "healthy skin"
+
+    Low-confidence predictions count as healthy skin; so does a
+    ``disease_percent`` of 1% or less when one is given.
+    """
+    if predictions is None or (disease_percent is not None and disease_percent <= 1):
         return None
+    predicted_class, confidence = summarize_prediction(predictions)
+    return predicted_class if confidence >= CONFIDENCE_THRESHOLD else None
+
+
+def list_images(directory, recursive=False):
+    """Sorted paths of the images in ``directory``, and in its sub-directories if ``recursive``"""
+    if recursive:
+        paths = [os.path.join(root, name) for root, _, files in os.walk(directory) for name in files]
+    else:
+        paths = [os.path.join(directory, name) for name in os.listdir(directory)]
+    return sorted(path for path in paths if path.lower().endswith(IMAGE_EXTENSIONS))
+
+
+def describe_result(disease_percent, predictions=None, status="ok"):
+    """JSON-friendly summary of one classification
+
+    ``status`` ends up "ok" (classified), "clear" (healthy skin) or stays as
+    given for uploads that never reached the model ("invalid", "error: ...").
+    """
+    record = {
+        "status": status,
+        "disease_percent": round(float(disease_percent), 4),
+        "predicted_class": None,
+        "class_name": None,
+        "confidence": None,
+    }
+    if predictions is not None:
+        predicted_class, confidence = summarize_prediction(predictions)
+        record["confidence"] = round(confidence, 4)
+        record["probabilities"] = [round(float(p), 6) for p in predictions]
+        if confidence >= CONFIDENCE_THRESHOLD:
+            record["predicted_class"] = predicted_class
+            record["class_name"] = CLASS_NAMES[predicted_class]
+        else:
+            record["status"] = "clear"
+    elif status == "ok":
+        record["status"] = "clear"
+    return record
+
+
+def prepare_model_input(original_image, mode="full", denoiser="nlmeans", keep_processed=True, normalize=True,
+                        max_lesions=1):
+    """Run every stage before the model; returns (processed_img, roi_img, disease_percent, model_input)
+
+    ``model_input`` is None when the affected area is too small to classify,
+    and uint8 without ``normalize``. Without ``keep_processed`` the ROI
+    outline is drawn straight onto the processed image, saving a full-frame
+    copy; ``processed_img`` is then the same array as ``roi_img``. Up to
+    ``max_lesions`` contours are kept in the analysis's ``lesion_contours``.
+    """
+    analysis = original_image if isinstance(original_image, ImageAnalysis) else ImageAnalysis(original_image)
+    # Callers that validated first already timed it; a cached repeat would record a ~0 ms sample
+    if analysis.is_valid is None:
+        with stage("validate"):
+            validate_image(analysis)
+    with stage("preprocess"):
+        processed_img = apply_advanced_preprocessing(analysis, mode=mode, denoiser=denoiser)
+    with stage("roi"):
+        # The upload's own buffer is shared, so only a freshly processed image may be drawn on
+        roi_img, disease_percent = remove_background_and_focus_roi(
+            processed_img if processed_img is not None else analysis.rgb,
+            analysis=analysis,
+            in_place=processed_img is not None and not keep_processed,
+            max_lesions=max_lesions
+        )
+
+    model_input = None
+    # FIX 2: Require at least 3% affected area
+    if disease_percent > 1:
+        with stage("model_input"):
+            model_input = preprocess_for_model(roi_img, analysis=analysis, normalize=normalize)
+
+    return processed_img, roi_img, disease_percent, model_input
+
+
+def run_pipeline(original_image, mode="full", denoiser="nlmeans", max_lesions=0, tta=False):
+    """Preprocess, locate the ROI and predict; returns a PipelineResult
+
+    ``original_image`` may be a PIL image, an array or an ImageAnalysis.
+    With ``max_lesions`` > 0 the largest lesions are also classified one by
+    one, in the same forward pass as the whole frame; each entry of
+    ``lesions`` then carries its own ``predictions``. With ``tta`` the whole
+    frame is classified from several augmented views in that same pass and
+    ``tta`` holds their agreement and the forward pass time.
+    """
+    analysis = original_image if isinstance(original_image, ImageAnalysis) else ImageAnalysis(original_image)
+    processed_img, roi_img, disease_percent, model_input = prepare_model_input(
+        analysis, mode=mode, denoiser=denoiser, keep_processed=bool(max_lesions), max_lesions=max(1, max_lesions)
+    )
+
+    lesions, lesion_inputs = None, None
+    if max_lesions and model_input is not None:
+        with stage("lesions"):
+            # The ROI stage already found these contours on the same image
+            lesions, lesion_inputs = lesion_model_inputs(
+                processed_img if processed_img is not None else analysis.rgb,
+                analysis=analysis, max_lesions=max_lesions, contours=analysis.lesion_contours
+            )
+
+    predictions, tta_stats = None, None
+    if model_input is not None:
+        model = load_model()
+        if model is not None:
+            views = tta_views(model_input) if tta else model_input
+            batch = views if lesion_inputs is None else np.concatenate([views, lesion_inputs])
+            start = time.perf_counter()
+            with stage("predict"):
+                outputs = apply_temperature(model.predict(batch), load_temperature())
+            if tta:
+                predictions, tta_stats = aggregate_tta(outputs[:len(views)])
+                tta_stats["predict_ms"] = (time.perf_counter() - start) * 1000
+            else:
+                predictions = outputs[0]
+            for lesion, lesion_predictions in zip(lesions or [], outputs[len(views):]):
+                lesion["predictions"] = lesion_predictions
+
+    return PipelineResult(processed_img, roi_img, disease_percent, predictions, lesions, tta_stats,
+                          analysis.roi_contour)
+
+
+def predict_remote(data, mode, denoiser, url):
+    """Classify an upload through inference_server.py; returns its JSON result"""
+    query = urlencode({"mode": mode, "denoiser": denoiser})
+    request = urllib.request.Request(
+        f"{url.rstrip('/')}/predict?{query}", data=data,
+        headers={"Content-Type": "application/octet-stream"}
+    )
+    with urllib.request.urlopen(request, timeout=REMOTE_TIMEOUT) as response:
+        return json.load(response)
+
+
+def run_live_mode(denoiser, source=LIVE_CAMERA_SOURCE):
+    """Annotated live view of the operator's LIVE_CAMERA_SOURCE (see camera_stream.py)"""
+    from camera_stream import FrameGrabber, StreamAnalyzer, annotate
+
+    if not st.toggle("Start"):
+        return
+
+    with st.spinner("မော်ဒယ်ကို ဖတ်ရှုနေပါသည်..."):
+        model = load_model()
+    if model is None:
+        return
+
+    try:
+        grabber = FrameGrabber(source)
+    except RuntimeError as e:
+        st.error(str(e))
+        return
+
+    analyzer = StreamAnalyzer(model, mode="fast", denoiser=denoiser)
+    frame_slot = st.empty()
+    result_slot = st.empty()
+    try:
+        while True:
+            frame = grabber.latest()
+            if frame is None:
+                if grabber.finished:
+                    break
+                continue
+            state = analyzer.process(frame)
+            frame_slot.image(annotate(frame, state), use_container_width=True)
+            if state["predicted_class"] is not None:
+                result_slot.markdown(
+                    f"**Disease Type:** {CLASS_NAMES_MM[state['predicted_class']]}  \n"
+                    f"**Accuracy:** {state['confidence']:.2f}%"
+                )
+            elif state["status"] == "no_skin":
+                result_slot.markdown('<div class="skin-warning">⚠️ ဤဓာတ်ပုံတွင် အရေပြားမပါဝင်ပါ</div>',
+                                     unsafe_allow_html=True)
+            else:
+                result_slot.markdown('<div class="clear-skin">ကျန်းမာသော အရေပြား (မည်သည့်ရောဂါမျှ မတွေ့ပါ)</div>',
+                                     unsafe_allow_html=True)
+    finally:
+        grabber.close()
+        analyzer.close()
+
+
+def show_debug_panel():
+    """Sidebar breakdown of the last upload's stages and per-stage percentiles"""
+    with st.sidebar.expander("Stage timings", expanded=True):
+        last_trace = st.session_state.get("last_trace")
+        if not os.environ.get("PIPELINE_TRACE_MEMORY"):
+            st.caption("Set PIPELINE_TRACE_MEMORY=1 to also record peak allocation")
+        if last_trace:
+            st.caption(f"Last upload: {last_trace['total_ms']:.1f} ms")
+            st.table([{"stage": name, **sample} for name, sample in last_trace["stages"].items()])
+        summary = METRICS.summary()
+        if summary:
+            st.caption("All uploads in this process")
+            st.table([{"stage": name, **row} for name, row in summary.items()])
+            st.download_button("Prometheus metrics", METRICS.prometheus(),
+                               file_name="metrics.prom", mime="text/plain")
+
+
+def show_lesions(image, lesions):
+    """Numbered lesion overlay and per-lesion results"""
+    st.subheader("Lesions")
+    st.image(draw_lesions(image, lesions), use_container_width=True)
+    rows = []
+    for number, lesion in enumerate(lesions, start=1):
+        if lesion.get("predictions") is None:
+            continue
+        predicted_class, confidence = summarize_prediction(lesion["predictions"])
+        rows.append({
+            "#": number,
+            "Disease Type": CLASS_NAMES_MM[predicted_class] if confidence >= CONFIDENCE_THRESHOLD else "-",
+            "Accuracy (%)": round(confidence, 2),
+            "Area (%)": round(lesion["area_percent"], 2),
+        })
+    if rows:
+        st.table(rows)
+
 
 def main():
     st.title("🩺 အရေပြားရောဂါရှာဖွေရေး")
     st.markdown(
         "ဤစနစ်သည် အရေပြားပြဿနာများကို အမျိုးအစား ၇ မျိုးအထိ မှန်ကန်စွာ ခွဲခြားနိုင်သည်။ အသုံးပြုသူသည် အရေပြားပြဿနာရှိသော ဓာတ်ပုံတစ်ပုံကို တင်သွင်းခြင်းဖြင့်၊ အဆိုပါရောဂါအမျိုးအစားနှင့် ပတ်သက်သော ခန့်မှန်းအဖြေကို အလွယ်တကူ ရရှိနိုင်သည်။")
 
-    uploaded_file = st.file_uploader("ဓာတ်ပုံတင်ပါ...", type=["jpg", "jpeg", "png"])
+    # With a remote inference server the UI never loads the model itself
+    server_url = os.environ.get("INFERENCE_SERVER_URL")
+
+    # Start loading in the background so the page renders right away
+    loader = get_model_loader()
+    if not server_url and os.environ.get("MODEL_LOADING", "background") == "background":
+        loader.start()
+
+    # "full" stays the default until compare_preprocessing.py shows the fast path agrees with it
+    preprocess_mode = st.sidebar.selectbox("Preprocessing mode", PREPROCESS_MODES)
+    denoiser = st.sidebar.selectbox("Denoiser", DENOISERS)
+    # The inference server classifies the whole frame in a single pass, so these only apply locally
+    remote_help = "Not available with INFERENCE_SERVER_URL" if server_url else None
+    max_lesions = MAX_LESIONS if st.sidebar.checkbox("Classify each lesion separately", disabled=bool(server_url),
+                                                     help=remote_help) else 0
+    tta = st.sidebar.checkbox("Test-time augmentation", disabled=bool(server_url), help=remote_help)
+    if server_url:
+        max_lesions, tta = 0, False
+    debug_panel = st.sidebar.checkbox("Debug: stage timings")
+    # Process-wide and never stopped, so only the operator turns it on
+    if os.environ.get("PIPELINE_TRACE_MEMORY"):
+        enable_memory_tracing()
+
+    live_mode = bool(LIVE_CAMERA_SOURCE) and st.sidebar.radio("Input", ["Upload", "Live camera"]) == "Live camera"
+
+    uploaded_file = None
+    if not live_mode:
+        uploaded_file = st.file_uploader("ဓာတ်ပုံတင်ပါ...", type=[ext[1:] for ext in IMAGE_EXTENSIONS])
 
     if uploaded_file is not None:
         try:
-            original_image = Image.open(uploaded_file)
+            cache = get_result_cache()
+            # A re-fitted calibration changes the probabilities, so it is part of the key
+            temperature = load_temperature()
+            # Hash the upload's buffer in place rather than copying it out
+            cache_key = content_key(uploaded_file.getbuffer(), preprocess_mode, denoiser, max_lesions, tta,
+                                    temperature)
+            result = cache.get(cache_key)
 
-            if not validate_image(original_image):
-                st.stop()
+            if result is None and server_url:
+                response = predict_remote(uploaded_file.getvalue(), preprocess_mode, denoiser, server_url)
+                if response["status"] == "invalid":
+                    st.markdown(
+                        '<div class="skin-warning">⚠️ ဤဓာတ်ပုံတွင် အရေပြားမပါဝင်ပါ (သို့) အရေပြားအစား အခြားအရာများပါဝင်နေပါသည်။ အရေပြားဓာတ်ပုံတင်ပေးပါ။</div>',
+                        unsafe_allow_html=True)
+                    st.stop()
+                probabilities = response.get("probabilities")
+                result = PipelineResult(
+                    None, None, response["disease_percent"],
+                    np.array(probabilities) if probabilities is not None else None
+                )
+                cache.put(cache_key, result)
 
-            processed_img = apply_advanced_preprocessing(original_image)
-            roi_img, disease_percent = remove_background_and_focus_roi(
-                processed_img if processed_img is not None else np.array(original_image)
-            )
+            if result is None:
+                if not loader.ready:
+                    with st.spinner("မော်ဒယ်ကို ဖတ်ရှုနေပါသည်..."):
+                        load_model()
+
+                with traced_request() as trace:
+                    with stage("decode"):
+                        uploaded_file.seek(0)
+                        analysis = ImageAnalysis(load_image(uploaded_file, mode=preprocess_mode))
+
+                    with stage("validate"):
+                        is_valid = validate_image(analysis)
+                    # Per-lesion results aren't persisted, so those runs bypass the store
+                    store = get_prediction_store() if is_valid and not max_lesions else None
+                    if store is not None:
+                        with stage("store"):
+                            image_hash, thumbnail = image_fingerprint(analysis.rgb)
+                            store_settings = (preprocess_mode, denoiser, tta, temperature)
+                            stored = store.get(image_hash, thumbnail, store_settings)
+                        if stored is not None:
+                            result = PipelineResult(None, None, stored["disease_percent"],
+                                                    stored["probabilities"], roi_contour=stored["roi_contour"])
+                    if is_valid and result is None:
+                        result = run_pipeline(analysis, mode=preprocess_mode, denoiser=denoiser,
+                                              max_lesions=max_lesions, tta=tta)
+                        # Without predictions above the area threshold the model failed; don't persist that
+                        if store is not None and (result.predictions is not None or result.disease_percent <= 1):
+                            store.put(image_hash, thumbnail, store_settings, result.disease_percent,
+                                      result.predictions, result.roi_contour)
+                st.session_state["last_trace"] = trace.as_dict()
+
+                if not is_valid:
+                    st.stop()
+                cache.put(cache_key, result)
+
+            disease_percent, predictions = result.disease_percent, result.predictions
 
             predicted_class = None
             confidence = 0
@@ -332,22 +1025,15 @@ def main():
             col1, col2 = st.columns(2)
             with col1:
                 st.subheader("ဆန်းစစ်မှု အဆင့်ဆင့်")
-                st.image(original_image, use_container_width=True, caption="ဓာတ်ပုံ")
+                st.image(uploaded_file, use_container_width=True, caption="ဓာတ်ပုံ")
 
-            # FIX 2: Require at least 3% affected area
             if disease_percent > 1:
-                model_input = preprocess_for_model(roi_img)
-                if model and model_input is not None:
-                    predictions = model.predict(model_input)
-                    predicted_class = np.argmax(predictions[0])
-                    confidence = np.max(predictions[0]) * 100
+                if predictions is not None:
+                    predicted_class, confidence = summarize_prediction(predictions)
                     disease_name = CLASS_NAMES_MM[predicted_class]
 
-                    if confidence > 99:
-                        confidence = 100
-
                     # FIX 3: If confidence is low → clear skin
-                    if confidence < 70:
+                    if confidence < CONFIDENCE_THRESHOLD:
                         st.markdown('<div class="clear-skin">ကျန်းမာသော အရေပြား (မည်သည့်ရောဂါမျှ မတွေ့ပါ)</div>',
                                     unsafe_allow_html=True)
                     else:
@@ -370,9 +1056,38 @@ def main():
                 st.markdown('<div class="clear-skin">ကျန်းမာသော အရေပြား (မည်သည့်ရောဂါမျှ မတွေ့ပါ)</div>',
                             unsafe_allow_html=True)
 
+            if result.tta:
+                st.caption(
+                    f"TTA: {result.tta['views']} views in one forward pass "
+                    f"({result.tta['predict_ms']:.0f} ms), "
+                    f"{result.tta['agreement']:.0f}% of views agree, "
+                    f"confidence spread ±{result.tta['confidence_spread']:.1f}%"
+                )
+
+            if result.lesions and result.processed_img is not None:
+                show_lesions(result.processed_img, result.lesions)
+
         except Exception as e:
             st.error(f"ဓာတ်ပုံ ဆန်းစစ်ရာတွင် အမှားတစ်ခုဖြစ်နေသည်: {str(e)}")
 
+    if loader.metrics:
+        with st.sidebar.expander("Startup metrics"):
+            st.json(loader.metrics)
+
+    # Only shown once an upload has opened the store, so first render doesn't hash the model
+    if uploaded_file is not None and not server_url:
+        store = get_prediction_store()
+        if store is not None:
+            with st.sidebar.expander("Prediction store"):
+                st.json(store.stats())
+
+    if debug_panel:
+        show_debug_panel()
+
+    # Runs until stopped, so it goes last
+    if live_mode:
+        run_live_mode(denoiser)
+
 
 if __name__ == "__main__":
     main()
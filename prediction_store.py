@@ -0,0 +1,238 @@
+"""Persistent on-disk store of pipeline predictions, keyed by perceptual hash.
+
+Repeat uploads of the same lesion photo, even re-compressed or resized, have
+the same (or a nearly equal) 64-bit difference hash. A stored entry holds the
+class probabilities, the affected area and the ROI outline, so such an upload
+is served by a SQLite lookup instead of preprocessing and inference, across
+process restarts.
+
+Skin photos are smooth and low-contrast, so different lesions can land on
+equal or nearby hashes. The hash only finds candidates: each one is
+confirmed against a 32x32 grayscale thumbnail stored with it, and rejected
+unless the thumbnails agree within MAX_MEAN_DIFF on average and
+MAX_PIXEL_DIFF everywhere. Re-compressed and resized copies stay well inside
+both; a photo that differs by one small lesion does not.
+
+Entries are tied to the SHA-256 digest of the model file the process loaded
+and to the settings that shaped the result. Opening the store with a new
+model digest deletes every entry made by another model.
+
+By default only equal hashes are candidates. Near-duplicate matching (up to
+3 differing bits) is opt-in: the hash is split into four 16-bit bands, each
+indexed, and two hashes within Hamming distance 3 share at least one band
+exactly, so candidates come from an index lookup and only they are compared
+bit by bit.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from functools import lru_cache
+
+import cv2
+import numpy as np
+
+DEFAULT_STORE_PATH = "predictions.db"
+DEFAULT_MAX_DISTANCE = 0
+DEFAULT_MAX_ENTRIES = 100_000
+HASH_SIZE = 8
+BANDS = 4
+BAND_BITS = HASH_SIZE * HASH_SIZE // BANDS
+THUMBNAIL_SIZE = 32
+# Largest mean and single-pixel gray-level differences between the thumbnails of a match
+MAX_MEAN_DIFF = 1.0
+MAX_PIXEL_DIFF = 6
+# Bumped whenever the table layout changes; older tables are dropped on open
+SCHEMA_VERSION = 2
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS predictions (
+    id INTEGER PRIMARY KEY,
+    model_hash TEXT NOT NULL,
+    settings TEXT NOT NULL,
+    phash INTEGER NOT NULL,
+    band0 INTEGER NOT NULL,
+    band1 INTEGER NOT NULL,
+    band2 INTEGER NOT NULL,
+    band3 INTEGER NOT NULL,
+    disease_percent REAL NOT NULL,
+    probabilities BLOB,
+    roi_contour BLOB,
+    thumbnail BLOB NOT NULL,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS predictions_band0 ON predictions (band0);
+CREATE INDEX IF NOT EXISTS predictions_band1 ON predictions (band1);
+CREATE INDEX IF NOT EXISTS predictions_band2 ON predictions (band2);
+CREATE INDEX IF NOT EXISTS predictions_band3 ON predictions (band3);
+"""
+
+
+def image_fingerprint(image):
+    """(hash, thumbnail) of an RGB or grayscale image
+
+    The image is shrunk straight to a THUMBNAIL_SIZE square and only that is
+    converted to gray, so large uploads get no full-size grayscale copy.
+    """
+    thumbnail = cv2.resize(image, (THUMBNAIL_SIZE, THUMBNAIL_SIZE), interpolation=cv2.INTER_AREA)
+    if thumbnail.ndim == 3:
+        thumbnail = cv2.cvtColor(thumbnail, cv2.COLOR_RGB2GRAY)
+    return perceptual_hash(thumbnail), thumbnail
+
+
+def perceptual_hash(gray):
+    """64-bit difference hash of a grayscale image: brighter-than-right-neighbour bits of a 9x8 thumbnail"""
+    thumbnail = cv2.resize(gray, (HASH_SIZE + 1, HASH_SIZE), interpolation=cv2.INTER_AREA)
+    bits = (thumbnail[:, 1:] > thumbnail[:, :-1]).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def thumbnails_match(a, b):
+    difference = np.abs(a.astype(np.int16) - b.astype(np.int16))
+    return difference.mean() <= MAX_MEAN_DIFF and difference.max() <= MAX_PIXEL_DIFF
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count("1")
+
+
+def bands(image_hash):
+    mask = (1 << BAND_BITS) - 1
+    return [(image_hash >> (i * BAND_BITS)) & mask for i in range(BANDS)]
+
+
+def to_signed(image_hash):
+    """SQLite integers are signed 64-bit"""
+    return image_hash - (1 << 64) if image_hash >= 1 << 63 else image_hash
+
+
+def file_digest(path):
+    """SHA-256 of a file, recomputed only when its size or modification time changes"""
+    stat = os.stat(path)
+    return _file_digest(os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+
+
+@lru_cache(maxsize=8)
+def _file_digest(path, size, mtime_ns):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class PredictionStore:
+    """Thread-safe SQLite store of predictions with thumbnail-confirmed lookup
+
+    ``max_distance`` is how many hash bits a candidate may differ in; it
+    must stay below BANDS for lookups to find every match. The oldest
+    entries are dropped beyond ``max_entries``.
+    """
+
+    def __init__(self, path=DEFAULT_STORE_PATH, model_hash="", max_distance=DEFAULT_MAX_DISTANCE,
+                 max_entries=DEFAULT_MAX_ENTRIES):
+        if max_distance >= BANDS:
+            raise ValueError(f"max_distance must be below {BANDS}")
+        self.path = path
+        self.model_hash = model_hash
+        self.max_distance = max_distance
+        self.max_entries = max_entries
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            # It's a cache, so an outdated layout is simply rebuilt
+            if self._db.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+                self._db.execute("DROP TABLE IF EXISTS predictions")
+                self._db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            self._db.executescript(SCHEMA)
+            self.invalidated = self._db.execute(
+                "DELETE FROM predictions WHERE model_hash != ?", (model_hash,)
+            ).rowcount
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM predictions").fetchone()[0]
+
+    def get(self, image_hash, thumbnail, settings):
+        """Closest confirmed result within ``max_distance`` bits, or None
+
+        ``image_hash`` and ``thumbnail`` come from image_fingerprint. Returns
+        a dict with ``disease_percent``, ``probabilities`` (None for results
+        that were not classified), ``roi_contour`` and ``distance``.
+        """
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT phash, disease_percent, probabilities, roi_contour, thumbnail FROM predictions "
+                "WHERE model_hash = ? AND settings = ? "
+                "AND (band0 = ? OR band1 = ? OR band2 = ? OR band3 = ?) ORDER BY id DESC",
+                (self.model_hash, _settings_key(settings), *bands(image_hash))
+            ).fetchall()
+            best, best_distance = None, self.max_distance + 1
+            for phash, disease_percent, probabilities, roi_contour, stored_thumbnail in rows:
+                distance = hamming_distance(image_hash, phash & (1 << 64) - 1)
+                if distance >= best_distance:
+                    continue
+                stored_thumbnail = np.frombuffer(stored_thumbnail, dtype=np.uint8).reshape(thumbnail.shape)
+                if not thumbnails_match(thumbnail, stored_thumbnail):
+                    self.rejected += 1
+                    continue
+                best, best_distance = (disease_percent, probabilities, roi_contour), distance
+            if best is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            if best_distance:
+                self.near_hits += 1
+
+        disease_percent, probabilities, roi_contour = best
+        return {
+            "disease_percent": disease_percent,
+            "probabilities": None if probabilities is None else np.frombuffer(probabilities, dtype=np.float32),
+            "roi_contour": None if roi_contour is None else np.frombuffer(roi_contour, dtype=np.float32).reshape(-1, 2),
+            "distance": best_distance,
+        }
+
+    def put(self, image_hash, thumbnail, settings, disease_percent, probabilities=None, roi_contour=None):
+        """Store one result; ``roi_contour`` is the ROI outline as (K, 2) fractions of width and height"""
+        row = (
+            self.model_hash, _settings_key(settings), to_signed(image_hash), *bands(image_hash),
+            float(disease_percent),
+            None if probabilities is None else np.asarray(probabilities, dtype=np.float32).tobytes(),
+            None if roi_contour is None else np.asarray(roi_contour, dtype=np.float32).tobytes(),
+            np.ascontiguousarray(thumbnail, dtype=np.uint8).tobytes(),
+            time.time(),
+        )
+        with self._lock, self._db:
+            row_id = self._db.execute(
+                "INSERT INTO predictions (model_hash, settings, phash, band0, band1, band2, band3, "
+                "disease_percent, probabilities, roi_contour, thumbnail, created) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                row
+            ).lastrowid
+            self._db.execute("DELETE FROM predictions WHERE id <= ?", (row_id - self.max_entries,))
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self),
+            "hits": self.hits,
+            "near_duplicate_hits": self.near_hits,
+            "misses": self.misses,
+            "rejected_candidates": self.rejected,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "invalidated_on_open": self.invalidated,
+        }
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def _settings_key(settings):
+    return "|".join(str(setting) for setting in settings)
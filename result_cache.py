@@ -0,0 +1,83 @@
+"""Bounded in-memory LRU cache for pipeline results.
+
+Entries are keyed by a hash of the uploaded bytes plus the preprocessing
+settings, so reruns of the same upload and repeat uploads of identical files
+are served without re-running the pipeline.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+DEFAULT_MAX_ENTRIES = 128
+
+
+def content_key(data, *settings):
+    """Hash of the raw upload bytes plus any settings that change the result"""
+    digest = hashlib.sha256(data)
+    for setting in settings:
+        digest.update(b"\0" + str(setting).encode())
+    return digest.hexdigest()
+
+
+def estimate_size(value, _seen=None):
+    """Approximate memory held by a cached value, in bytes (shared arrays counted once)"""
+    seen = set() if _seen is None else _seen
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (tuple, list)):
+        return sum(estimate_size(v, seen) for v in value)
+    if isinstance(value, dict):
+        return sum(estimate_size(v, seen) for v in value.values())
+    return 64
+
+
+class ResultCache:
+    """Thread-safe LRU cache capped by entry count and total size"""
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, max_entries=DEFAULT_MAX_ENTRIES):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        size = estimate_size(value)
+        if size > self.max_bytes:
+            return False
+        with self._lock:
+            if key in self._entries:
+                self.current_bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self.current_bytes += size
+            while self._entries and (
+                    self.current_bytes > self.max_bytes or len(self._entries) > self.max_entries):
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+        return True
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
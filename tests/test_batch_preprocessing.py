@@ -0,0 +1,99 @@
+import cv2
+import numpy as np
+import pytest
+
+import main
+
+
+def letterbox_one(image):
+    """preprocess_for_model's per-image letterbox before the batch version"""
+    if len(image.shape) == 2:
+        image = cv2.cvtColor(image, cv2.COLOR_GRAY2RGB)
+    elif image.shape[2] == 4:
+        image = image[:, :, :3]
+    height, width = image.shape[:2]
+    target_size = main.MODEL_INPUT_SIZE
+    if height > width:
+        new_height = target_size
+        new_width = int(width * (target_size / height))
+    else:
+        new_width = target_size
+        new_height = int(height * (target_size / width))
+    resized = cv2.resize(image, (new_width, new_height))
+    delta_w = target_size - new_width
+    delta_h = target_size - new_height
+    top, bottom = delta_h // 2, delta_h - (delta_h // 2)
+    left, right = delta_w // 2, delta_w - (delta_w // 2)
+    img = cv2.copyMakeBorder(resized, top, bottom, left, right, cv2.BORDER_CONSTANT, value=[0, 0, 0])
+    return np.expand_dims(img.astype('float32') / 255.0, axis=0)
+
+
+@pytest.fixture
+def images():
+    rng = np.random.default_rng(0)
+    shapes = [(300, 500, 3), (500, 300, 3), (224, 224, 3), (1001, 999, 3), (61, 77, 3),
+              (120, 90, 4), (90, 130), (223, 225)]
+    return [rng.integers(0, 256, shape, dtype=np.uint8) for shape in shapes]
+
+
+def test_batch_matches_per_image_letterbox(images):
+    batch = main.preprocess_for_model_batch(images)
+    assert batch.shape == (len(images), 224, 224, 3)
+    assert batch.dtype == np.float32
+    for slot, image in zip(batch, images):
+        np.testing.assert_array_equal(slot, letterbox_one(image)[0])
+
+
+def test_batch_reuses_buffer_and_clears_stale_padding(images):
+    buffer = np.full((len(images) + 2, 224, 224, 3), 7, dtype=np.float32)
+    batch = main.preprocess_for_model_batch(images, out=buffer)
+    assert np.shares_memory(batch, buffer)
+    for slot, image in zip(batch, images):
+        np.testing.assert_array_equal(slot, letterbox_one(image)[0])
+
+
+def test_uint8_batch_normalizes_to_float_batch(images):
+    raw = main.preprocess_for_model_batch(images, normalize=False)
+    assert raw.dtype == np.uint8
+    np.testing.assert_array_equal(raw / np.float32(255.0), main.preprocess_for_model_batch(images))
+
+
+def test_single_image_path_is_unchanged(images):
+    image = images[0]
+    analysis = main.ImageAnalysis(image)
+    analysis.is_valid = True
+    np.testing.assert_array_equal(main.preprocess_for_model(image, analysis=analysis), letterbox_one(image))
+
+
+def skin_images():
+    rng = np.random.default_rng(1)
+    images = []
+    for height, width in [(480, 640), (50, 50), (300, 200), (1200, 1600)]:
+        img = np.empty((height, width, 3), dtype=np.uint8)
+        img[...] = (205, 150, 120)
+        img[:, : width // 3] = rng.integers(0, 256, (height, width // 3, 3))
+        images.append(img)
+    return images
+
+
+def whole_image_skin_percentage(image):
+    skin_mask = cv2.inRange(cv2.cvtColor(image, cv2.COLOR_RGB2HSV), main.LOWER_SKIN, main.UPPER_SKIN)
+    return cv2.countNonZero(skin_mask) / (image.shape[0] * image.shape[1]) * 100
+
+
+@pytest.mark.parametrize("chunk_pixels", [main.SKIN_CHUNK_PIXELS, 1, 200_000])
+def test_skin_percentages_match_whole_image_conversion(monkeypatch, chunk_pixels):
+    monkeypatch.setattr(main, "SKIN_CHUNK_PIXELS", chunk_pixels)
+    images = skin_images()
+    expected = [whole_image_skin_percentage(image) for image in images]
+    assert main.skin_percentages(images) == pytest.approx(expected, abs=1e-12)
+    assert [main.ImageAnalysis(image).skin_percentage for image in images] == pytest.approx(expected, abs=1e-12)
+
+
+def test_validate_images_matches_validate_image():
+    images = skin_images() + [np.zeros((40, 400, 3), np.uint8), np.full((100, 100, 3), (10, 200, 10), np.uint8),
+                              np.full((80, 80), 128, np.uint8)]
+    expected = [main.validate_image(main.ImageAnalysis(image)) for image in images]
+    analyses = [main.ImageAnalysis(image) for image in images]
+    assert main.validate_images(analyses) == expected
+    assert [analysis.is_valid for analysis in analyses] == expected
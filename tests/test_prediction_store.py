@@ -0,0 +1,127 @@
+import sqlite3
+
+import numpy as np
+import pytest
+
+from prediction_store import PredictionStore, bands, hamming_distance, image_fingerprint, to_signed
+
+SETTINGS = ("fast", "bilateral", False, 1.0)
+BASE_HASH = 0xF0F0_1234_8000_00FF  # high bit set: stored as a negative SQLite integer
+
+
+@pytest.fixture
+def thumbnail():
+    return np.random.default_rng(0).integers(0, 256, (32, 32), dtype=np.uint8)
+
+
+def open_store(tmp_path, **kwargs):
+    return PredictionStore(str(tmp_path / "predictions.db"), model_hash="model-a", **kwargs)
+
+
+def flip(image_hash, *bits):
+    for bit in bits:
+        image_hash ^= 1 << bit
+    return image_hash
+
+
+def test_bands_split_hash_into_16_bit_words():
+    assert bands(BASE_HASH) == [0x00FF, 0x8000, 0x1234, 0xF0F0]
+    assert to_signed(BASE_HASH) < 0
+
+
+@pytest.mark.parametrize("bits", [(), (0,), (0, 17), (1, 20, 40), (15, 31, 47), (63,), (62, 63)])
+def test_band_lookup_finds_every_hash_within_three_bits(tmp_path, thumbnail, bits):
+    store = open_store(tmp_path, max_distance=3)
+    store.put(BASE_HASH, thumbnail, SETTINGS, 12.5, np.full(7, 1 / 7))
+    query = flip(BASE_HASH, *bits)
+    result = store.get(query, thumbnail, SETTINGS)
+    assert result is not None
+    assert result["distance"] == len(bits) == hamming_distance(query, BASE_HASH)
+    assert result["disease_percent"] == 12.5
+
+
+def test_band_lookup_ignores_hashes_four_bits_away(tmp_path, thumbnail):
+    store = open_store(tmp_path, max_distance=3)
+    store.put(BASE_HASH, thumbnail, SETTINGS, 12.5)
+    # One bit in each band: no band matches, so the row isn't even a candidate
+    assert store.get(flip(BASE_HASH, 0, 16, 32, 48), thumbnail, SETTINGS) is None
+    # Four bits in one band: a candidate, rejected by distance
+    assert store.get(flip(BASE_HASH, 0, 1, 2, 3), thumbnail, SETTINGS) is None
+
+
+def test_closest_match_wins(tmp_path, thumbnail):
+    store = open_store(tmp_path, max_distance=3)
+    store.put(flip(BASE_HASH, 0, 1), thumbnail, SETTINGS, 1.0)
+    store.put(flip(BASE_HASH, 5), thumbnail, SETTINGS, 2.0)
+    store.put(flip(BASE_HASH, 2, 3, 4), thumbnail, SETTINGS, 3.0)
+    assert store.get(BASE_HASH, thumbnail, SETTINGS)["disease_percent"] == 2.0
+
+
+def test_exact_matches_only_by_default(tmp_path, thumbnail):
+    store = open_store(tmp_path)
+    store.put(BASE_HASH, thumbnail, SETTINGS, 12.5)
+    assert store.get(flip(BASE_HASH, 0), thumbnail, SETTINGS) is None
+    assert store.get(BASE_HASH, thumbnail, SETTINGS)["distance"] == 0
+
+
+def test_hash_match_with_different_thumbnail_is_rejected(tmp_path, thumbnail):
+    store = open_store(tmp_path)
+    store.put(BASE_HASH, thumbnail, SETTINGS, 12.5)
+    other = thumbnail.copy()
+    other[10:14, 10:14] = 255 - other[10:14, 10:14]  # a small region changed, e.g. another lesion
+    assert store.get(BASE_HASH, other, SETTINGS) is None
+    assert store.stats()["rejected_candidates"] == 1
+    nudged = np.clip(thumbnail.astype(np.int16) + 1, 0, 255).astype(np.uint8)  # re-compression noise
+    assert store.get(BASE_HASH, nudged, SETTINGS) is not None
+
+
+def test_settings_are_part_of_the_key(tmp_path, thumbnail):
+    store = open_store(tmp_path)
+    store.put(BASE_HASH, thumbnail, SETTINGS, 12.5)
+    assert store.get(BASE_HASH, thumbnail, ("full", "nlmeans", False, 1.0)) is None
+
+
+def test_round_trips_probabilities_and_contour(tmp_path, thumbnail):
+    store = open_store(tmp_path)
+    contour = np.array([[0.1, 0.2], [0.3, 0.4], [0.5, 0.1]])
+    store.put(BASE_HASH, thumbnail, SETTINGS, 12.5, np.arange(7) / 21, contour)
+    store.put(flip(BASE_HASH, 9, 30), thumbnail, SETTINGS, 0.5)
+    result = store.get(BASE_HASH, thumbnail, SETTINGS)
+    np.testing.assert_allclose(result["probabilities"], np.arange(7) / 21, rtol=1e-6)
+    np.testing.assert_allclose(result["roi_contour"], contour, rtol=1e-6)
+    assert store.get(flip(BASE_HASH, 9, 30), thumbnail, SETTINGS)["probabilities"] is None
+
+
+def test_model_change_invalidates_entries(tmp_path, thumbnail):
+    store = open_store(tmp_path)
+    store.put(BASE_HASH, thumbnail, SETTINGS, 12.5)
+    store.close()
+    assert len(open_store(tmp_path)) == 1
+    replaced = PredictionStore(str(tmp_path / "predictions.db"), model_hash="model-b")
+    assert replaced.invalidated == 1
+    assert replaced.get(BASE_HASH, thumbnail, SETTINGS) is None
+
+
+def test_outdated_schema_is_rebuilt(tmp_path, thumbnail):
+    with sqlite3.connect(str(tmp_path / "predictions.db")) as db:
+        db.execute("CREATE TABLE predictions (id INTEGER PRIMARY KEY, phash INTEGER)")
+    store = open_store(tmp_path)
+    store.put(BASE_HASH, thumbnail, SETTINGS, 12.5)
+    assert store.get(BASE_HASH, thumbnail, SETTINGS) is not None
+
+
+def test_oldest_entries_are_dropped(tmp_path, thumbnail):
+    store = open_store(tmp_path, max_entries=3)
+    for i in range(10):
+        store.put(i << 40, thumbnail, SETTINGS, float(i))
+    assert len(store) == 3
+
+
+def test_fingerprint_is_stable_under_resizing():
+    rng = np.random.default_rng(0)
+    image = np.repeat(np.repeat(rng.integers(60, 200, (48, 64, 3), dtype=np.uint8), 10, axis=0), 10, axis=1)
+    image_hash, thumbnail = image_fingerprint(image)
+    resized_hash, resized_thumbnail = image_fingerprint(image[::2, ::2])
+    assert thumbnail.shape == (32, 32) and thumbnail.dtype == np.uint8
+    assert hamming_distance(image_hash, resized_hash) <= 1
+    assert np.abs(thumbnail.astype(int) - resized_thumbnail).max() <= 6